@@ -1,17 +1,33 @@
+import atexit
+import csv
+import io
+import json
 import os
 import logging
-from flask import Flask, jsonify, request, send_from_directory
+import threading
+import time
+import config
+from flask import Flask, g, jsonify, request, stream_with_context
 from flask_cors import CORS
+from gc_recurring import ended_before
+from logos import Logos, RENDITIONS
+from metrics import Metrics
 from models import Client, Project, Task
+from profiles import Profile, ProfileMiddleware, Profiles, requested_profile
+from recurrence import parse_date
+from search import SearchIndex
+from sqlite_storage import SQLiteStorage
+from static_assets import StaticAssets
 from storage import Storage
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 
 
 class HealthCheckFilter(logging.Filter):
-    """Filter to exclude health check requests from logs."""
+    """Filter to exclude health check and metrics requests from logs."""
     def filter(self, record):
         message = record.getMessage()
-        return '/health' not in message
+        return '/health' not in message and '/metrics' not in message
 
 
 # Apply filter to Werkzeug logger
@@ -19,39 +35,365 @@ logging.getLogger('werkzeug').addFilter(HealthCheckFilter())
 
 app = Flask(__name__, static_folder=None)
 CORS(app)
+# /p/<name>/... is served from the profile <name>, as if the prefix were not there
+app.wsgi_app = ProfileMiddleware(app.wsgi_app)
 
-storage = Storage('data')
+# Startup and maintenance reports go to stderr like the server's own log, whatever the root logger's level
+logging.getLogger('tasklord').setLevel(logging.INFO)
+logging.getLogger('tasklord').addHandler(logging.StreamHandler())
+logging.getLogger('tasklord').propagate = False
+startup_logger = logging.getLogger('tasklord.startup')
+maintenance_logger = logging.getLogger('tasklord.maintenance')
+
+metrics = Metrics()
+
+
+def open_profile(name, path, sqlite_path=None):
+    """Open the storage of a data directory, with its search index and logos.
+
+    Opening either storage reads no data; that happens on the first request that needs it.
+    """
+    if config.STORAGE == 'sqlite':
+        storage = SQLiteStorage(path, db_path=sqlite_path, change_log_size=config.CHANGE_LOG_SIZE)
+    else:
+        storage = Storage(
+            path,
+            month_cache_size=config.MONTH_CACHE_SIZE,
+            verify_summaries=config.VERIFY_SUMMARIES,
+            pretty_json=config.PRETTY_JSON,
+            journal=config.JOURNAL,
+            journal_compact_interval=config.JOURNAL_COMPACT_INTERVAL,
+            journal_max_records=config.JOURNAL_MAX_RECORDS,
+            change_log_size=config.CHANGE_LOG_SIZE,
+            entity_snapshot=config.ENTITY_SNAPSHOT,
+            # Enough for a summary of the longest range allowed
+            rollup_cache_size=config.MAX_RANGE_MONTHS
+        )
+    # Full-text index over task titles and notes, saved next to the data and read on the first search
+    search_index = SearchIndex(storage, os.path.join(storage.path, 'search_index.json'))
+    # Logo renditions, generated in the background, and a cache of the logos served
+    logos = Logos(storage.logos_path, os.path.join(storage.path, 'logo_renditions'), cache_size=config.LOGO_CACHE_SIZE)
+    return Profile(name, storage, search_index, logos)
+
+
+# Requests without a profile use the data directory, which stays open
+with metrics.phase('default_profile'):
+    default_profile = open_profile(None, config.DATA_PATH, config.SQLITE_PATH)
+# The others are opened on their first request and closed again when idle and least recently used
+with metrics.phase('profiles'):
+    profiles = Profiles(config.PROFILES_PATH, open_profile, max_open=config.PROFILES_OPEN)
+# Save the search indexes, and fold the journals into the data files or close the databases, when the worker exits
+atexit.register(default_profile.close)
+atexit.register(profiles.close)
+
+# The storage, search index and logos of the profile the current request is for
+storage = LocalProxy(lambda: g.profile.storage)
+search_index = LocalProxy(lambda: g.profile.search_index)
+logos = LocalProxy(lambda: g.profile.logos)
 
 # Path to production frontend build
 FRONTEND_BUILD = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend', 'build'))
+# Read and compressed on the first request, re-indexed when the build changes
+with metrics.phase('static_assets'):
+    assets = StaticAssets(FRONTEND_BUILD)
+
+
+def collect_recurring_garbage_periodically():
+    """Drop deleted and long-ended recurring series every RECURRING_GC_HOURS hours."""
+    while True:
+        time.sleep(config.RECURRING_GC_HOURS * 3600)
+        # Profiles that are not open are left for when they are (or for gc_recurring.py --data)
+        for name in [None] + profiles.names():
+            profile = profiles.acquire(name) if name else default_profile
+            if profile is None:
+                continue
+            try:
+                report = profile.storage.collect_recurring_garbage(ended_before(config.RECURRING_RETENTION_DAYS))
+            except Exception:
+                maintenance_logger.exception("Recurring series garbage collection failed in %s", profile.storage.path)
+                continue
+            finally:
+                if name:
+                    profiles.release(profile)
+            if report['deleted_series_dropped'] or report['ended_series_dropped']:
+                maintenance_logger.info("Dropped recurring series in %s: %s", profile.storage.path, json.dumps(report))
+
+
+if config.RECURRING_GC_HOURS > 0:
+    threading.Thread(target=collect_recurring_garbage_periodically, name='recurring-gc', daemon=True).start()
+
+startup_logger.info("Started in %s", metrics.startup_report())
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def select_profile():
+    """Use the profile named by the URL prefix or header, if any, for the rest of the request."""
+    name = requested_profile(request)
+    if name is None:
+        g.profile = default_profile
+        return None
+    profile = profiles.acquire(name)
+    if profile is None:
+        return jsonify({"status": "error", "message": f"unknown profile {name}"}), 404
+    g.profile = profile
+    return None
+
+@app.teardown_request
+def release_profile(exc):
+    # Streamed responses hold on to the profile until they are sent
+    profile = g.pop('profile', None)
+    if profile is not None and profile is not default_profile:
+        profiles.release(profile)
+
+@app.after_request
+def record_timing(response):
+    """Count the request in its route's latency histogram and optionally report its duration."""
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    # Streamed bodies are still being generated at this point, so this is the time to start answering
+    elapsed = time.perf_counter() - start
+    if config.METRICS:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe(route, request.method, response.status_code, elapsed)
+    if config.SERVER_TIMING:
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+    return response
+
+def conditional_json(version, load):
+    """Answer 304 if the client already has this version, otherwise load and serialize it."""
+    if request.if_none_match.contains_weak(version):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(load())
+    # Weak: the tag names a version of the data, not exact bytes
+    response.set_etag(version, weak=True)
+    # Let browsers keep the response but revalidate it every time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def range_error(start, end):
+    """Check the from and to dates of a range request: the error response, or None if they are usable."""
+    if not start or not end:
+        return jsonify({"status": "error", "message": "from and to dates are required"}), 400
+    try:
+        first, last = parse_date(start), parse_date(end)
+    except ValueError:
+        return jsonify({"status": "error", "message": "dates must be YYYY-MM-DD"}), 400
+    if last < first:
+        return jsonify({"status": "error", "message": "to must not be before from"}), 400
+    if (last.year - first.year) * 12 + last.month - first.month + 1 > config.MAX_RANGE_MONTHS:
+        return jsonify({"status": "error", "message": f"ranges may span at most {config.MAX_RANGE_MONTHS} months"}), 400
+    return None
+
+def task_from_json(data, task_id=None):
+    """Build a task from a request body."""
+    return Task(
+        id=task_id,
+        project_id=data['project_id'],
+        client_id=data['client_id'],
+        date=data['date'],
+        hours=float(data['hours']),
+        title=data['title'],
+        notes=data.get('notes', ''),
+        recurring=data.get('recurring', None)
+    )
 
+def batch_operation(item):
+    """Turn one item of a batch request into an (op, task) pair, or (op, id) for deletes."""
+    if not isinstance(item, dict):
+        raise ValueError("each operation must be an object")
+    op = item.get('op')
+    if op == 'delete':
+        return op, item['id']
+    if op not in ('create', 'update'):
+        raise ValueError("op must be create, update or delete")
+    task = task_from_json(item, item['id'] if op == 'update' else None)
+    parse_date(task.date)
+    return op, task
 
 @app.route('/api/tasks/<year>/<month>', methods=['GET'])
 def get_tasks(year, month):
     """Get all tasks for a specific month."""
-    return jsonify(storage.load_month(int(year), int(month)))
+    try:
+        year, month = int(year), int(month)
+    except ValueError:
+        return jsonify({"status": "error", "message": "year and month must be numbers"}), 400
+    if not 1 <= year <= 9999 or not 1 <= month <= 12:
+        return jsonify({"status": "error", "message": "month must be 1 to 12 in years 1 to 9999"}), 400
+    return conditional_json(storage.month_version(year, month), lambda: storage.load_month(year, month))
 
 @app.route('/api/recurring-tasks', methods=['GET'])
 def get_recurring_tasks():
     """Get all recurring tasks."""
     return jsonify(storage.load_recurring_tasks())
 
+@app.route('/api/recurring-tasks/occurrences', methods=['GET'])
+def get_recurring_occurrences():
+    """Expand recurring tasks into their occurrences between two dates."""
+    start = request.args.get('from')
+    end = request.args.get('to')
+    error = range_error(start, end)
+    if error:
+        return error
+    return jsonify(storage.expand_recurring_tasks(start, end))
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Get what changed since a sequence number, or just the latest sequence number."""
+    since = request.args.get('since')
+    if since is None:
+        return jsonify({"seq": storage.change_seq()})
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({"status": "error", "message": "since must be a sequence number"}), 400
+    return jsonify(storage.changes_since(since))
+
+@app.route('/api/search', methods=['GET'])
+def search_tasks():
+    """Find tasks by words in their title or notes, newest first."""
+    query = request.args.get('q', '')
+    start = request.args.get('from')
+    end = request.args.get('to')
+    if not query.strip():
+        return jsonify({"status": "error", "message": "q is required"}), 400
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"status": "error", "message": "offset and limit must be numbers"}), 400
+    if offset < 0 or not 1 <= limit <= 500:
+        return jsonify({"status": "error", "message": "offset must not be negative and limit must be 1 to 500"}), 400
+    try:
+        for value in (start, end):
+            if value:
+                parse_date(value)
+    except ValueError:
+        return jsonify({"status": "error", "message": "dates must be YYYY-MM-DD"}), 400
+
+    return jsonify(search_index.search(
+        query,
+        client_id=request.args.get('client_id'),
+        project_id=request.args.get('project_id'),
+        start=start,
+        end=end,
+        offset=offset,
+        limit=limit
+    ))
+
+@app.route('/api/summary', methods=['GET'])
+def get_summary():
+    """Get hours and amounts between two dates, grouped by client, project or month."""
+    start = request.args.get('from')
+    end = request.args.get('to')
+    group_by = request.args.get('group_by', 'client')
+    error = range_error(start, end)
+    if error:
+        return error
+    if group_by not in ('client', 'project', 'month'):
+        return jsonify({"status": "error", "message": "group_by must be client, project or month"}), 400
+    return jsonify(storage.summarize(start, end, group_by))
+
+EXPORT_COLUMNS = ['date', 'client', 'project', 'title', 'notes', 'hours', 'rate', 'amount', 'recurring', 'id']
+
+@app.route('/api/export', methods=['GET'])
+def export_tasks():
+    """Stream the tasks between two dates as CSV or NDJSON, priced with the rate on each date."""
+    start = request.args.get('from')
+    end = request.args.get('to')
+    export_format = request.args.get('format', 'csv')
+    # Checked up front: once streaming has started there is no way to report an error
+    error = range_error(start, end)
+    if error:
+        return error
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"status": "error", "message": "format must be csv or ndjson"}), 400
+
+    rows = storage.export_rows(start, end, request.args.get('client_id'), request.args.get('project_id'))
+    client_names = {c.id: c.name for c in storage.load_clients()}
+    project_names = {p.id: p.name for p in storage.load_projects()}
+
+    def records():
+        for task, rate in rows:
+            yield {
+                'date': task.date,
+                'client': client_names.get(task.client_id, task.client_id),
+                'project': project_names.get(task.project_id, task.project_id),
+                'title': task.title,
+                'notes': task.notes,
+                'hours': task.hours,
+                'rate': rate,
+                'amount': task.hours * rate if rate is not None else None,
+                'recurring': task.recurring or '',
+                'id': task.id
+            }
+
+    def generate():
+        # Rows are sent in chunks of about 64 KiB
+        buffer = io.StringIO()
+        if export_format == 'csv':
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+        for record in records():
+            if export_format == 'csv':
+                writer.writerow(record)
+            else:
+                buffer.write(json.dumps(record) + '\n')
+            if buffer.tell() >= 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    filename = f"tasks_{start}_{end}.{export_format}"
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @app.route('/api/tasks', methods=['POST'])
 def add_task():
     """Add a new task."""
-    data = request.json
-    task = Task(
-        project_id=data['project_id'],
-        client_id=data['client_id'],
-        date=data['date'],
-        hours=float(data['hours']),
-        title=data['title'],
-        notes=data.get('notes', ''),
-        recurring=data.get('recurring', None)
-    )
+    task = task_from_json(request.json)
     storage.save_task(task)
     return jsonify({"status": "success", "id": task.id})
 
+@app.route('/api/tasks/batch', methods=['POST'])
+def batch_tasks():
+    """Create, update and delete many tasks at once.
+
+    Takes {"operations": [...]}, each {"op": "create", ...task}, {"op": "update", "id": ..., ...task}
+    or {"op": "delete", "id": ...}, and answers with one result per operation, in order.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"status": "error", "message": "body must be a JSON object"}), 400
+    items = body.get('operations')
+    if not isinstance(items, list):
+        return jsonify({"status": "error", "message": "operations must be a list"}), 400
+
+    results = [None] * len(items)
+    operations, positions = [], []
+    for index, item in enumerate(items):
+        try:
+            operations.append(batch_operation(item))
+        except (KeyError, TypeError, ValueError) as e:
+            message = f"missing field {e}" if isinstance(e, KeyError) else str(e)
+            results[index] = {"id": item.get('id') if isinstance(item, dict) else None, "status": "error", "message": message}
+            continue
+        positions.append(index)
+
+    for index, result in zip(positions, storage.apply_batch(operations)):
+        results[index] = result
+
+    return jsonify({"status": "success", "results": results})
+
 @app.route('/api/tasks/<task_id>', methods=['PUT', 'DELETE'])
 def manage_task(task_id):
     """Update or delete a specific task."""
@@ -59,25 +401,18 @@ def manage_task(task_id):
         storage.delete_task(task_id)
         return jsonify({"status": "success"})
 
-    data = request.json
-    task = Task(
-        id=task_id,
-        project_id=data['project_id'],
-        client_id=data['client_id'],
-        date=data['date'],
-        hours=float(data['hours']),
-        title=data['title'],
-        notes=data.get('notes', ''),
-        recurring=data.get('recurring', None)
-    )
-    storage.update_task(task)
+    task = task_from_json(request.json, task_id)
+    try:
+        storage.update_task(task)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     return jsonify({"status": "success"})
 
 @app.route('/api/projects', methods=['GET', 'POST'])
 def manage_projects():
     """Get all projects or create a new project."""
     if request.method == 'GET':
-        return jsonify(storage.load_projects())
+        return conditional_json(storage.projects_version(), storage.load_projects)
 
     data = request.json
 
@@ -134,7 +469,7 @@ def get_client_projects(client_id):
 def manage_clients():
     """Get all clients or create a new client."""
     if request.method == 'GET':
-        return jsonify(storage.load_clients())
+        return conditional_json(storage.clients_version(), storage.load_clients)
 
     # Handle multipart form data for logo upload
     name = request.form.get('name')
@@ -147,6 +482,7 @@ def manage_clients():
         logo_path = storage.save_client_logo(client.id, logo)
         client.logo_path = logo_path
         storage.update_client(client)
+        logos.render_async(os.path.basename(logo_path))
 
     return jsonify({"status": "success", "id": client.id})
 
@@ -168,26 +504,37 @@ def manage_specific_client(client_id):
     if logo:
         logo_path = storage.save_client_logo(client_id, logo)
         client.logo_path = logo_path
+        logos.render_async(os.path.basename(logo_path))
         
     storage.update_client(client)
     return jsonify({"status": "success"})
 
 @app.route('/api/logos/<filename>')
 def serve_logo(filename):
-    """Serve client logo files."""
-    return send_from_directory(storage.logos_path, filename)
+    """Serve a client logo, or with ?size= one of its fixed-size renditions."""
+    size = request.args.get('size')
+    if size is not None and size not in RENDITIONS:
+        return jsonify({"status": "error", "message": f"size must be one of {', '.join(RENDITIONS)}"}), 400
+    return logos.response(filename, size) or ('Not found', 404)
 
 @app.route('/health')
 def health():
     """Health check endpoint for service monitoring."""
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "month_cache": storage.cache_stats()})
+
+@app.route('/metrics')
+def get_metrics():
+    """Request latencies, storage I/O and cache statistics in the Prometheus text format."""
+    if not config.METRICS:
+        return jsonify({"status": "error", "message": "metrics are disabled"}), 404
+    return app.response_class(metrics.render(storage, logos.cache_stats(), profiles.cache_stats()), mimetype='text/plain; version=0.0.4')
 
 
 # Serve React production build static assets
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve static assets from the React build."""
-    return send_from_directory(os.path.join(FRONTEND_BUILD, 'static'), filename)
+    return assets.response(f'static/{filename}') or ('Not found', 404)
 
 
 # Serve React production build (catch-all for SPA routing)
@@ -195,10 +542,9 @@ def serve_static(filename):
 @app.route('/<path:path>')
 def serve_frontend(path):
     """Serve frontend files and handle SPA routing."""
-    if path and os.path.exists(os.path.join(FRONTEND_BUILD, path)):
-        return send_from_directory(FRONTEND_BUILD, path)
-    return send_from_directory(FRONTEND_BUILD, 'index.html')
+    return assets.response(path if path and assets.exists(path) else 'index.html') or ('Not found', 404)
 
 
 if __name__ == '__main__':
-    app.run(debug=False, port=3000)
+    # Development server; production runs wsgi:app under gunicorn (see run.sh)
+    app.run(debug=False, host=config.HOST, port=config.PORT, threaded=True)
@@ -0,0 +1,208 @@
+"""Storage benchmarks on synthetic data.
+
+Generates a data directory (clients, projects with rate changes, years of
+months, recurring series), then times scenarios against the storage layer
+and the Flask endpoints and prints the results as JSON, for comparing runs.
+
+    python bench.py --years 5 --tasks-per-month 120 --output results.json
+    python bench.py --backend sqlite --scenarios load_month_cold,summarize_year
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from datetime import date
+
+from models import Client, Project, Task
+from sqlite_storage import SQLiteStorage
+from storage import Storage
+
+TITLES = ['Standup', 'Code review', 'Planning meeting', 'Customer support', 'Deployment', 'Design work',
+          'Bug fixing', 'Documentation', 'Refactoring', 'Interview']
+
+
+def open_storage(backend, path, **options):
+    if backend == 'sqlite':
+        return SQLiteStorage(path)
+    return Storage(path, **options)
+
+
+def generate(path, backend='json', clients=5, projects_per_client=3, rate_changes=2, years=3,
+             tasks_per_month=100, recurring=5, first_year=2020, seed=1):
+    """Fill a data directory with synthetic clients, projects and tasks.
+
+    Returns:
+        The months generated, as (year, month) pairs
+    """
+    rng = random.Random(seed)
+    storage = open_storage(backend, path, journal=False)
+
+    projects = []
+    for c in range(clients):
+        client = Client(name=f'Client {c}')
+        storage.save_client(client)
+        for p in range(projects_per_client):
+            changes = [{'hourly_rate': rng.choice([40, 50, 60, 75]), 'effective_date': None}]
+            for r in range(rate_changes):
+                effective = date(first_year + rng.randrange(years), rng.randint(1, 12), 1)
+                changes.append({'hourly_rate': changes[-1]['hourly_rate'] + 5, 'effective_date': effective.isoformat()})
+            project = Project(name=f'Project {c}.{p}', client_id=client.id, color='#888888', rate_changes=changes)
+            storage.save_project(project)
+            projects.append(project)
+
+    months = [(year, month) for year in range(first_year, first_year + years) for month in range(1, 13)]
+    for year, month in months:
+        storage.apply_batch([('create', Task(
+            project_id=project.id,
+            client_id=project.client_id,
+            date=f'{year}-{month:02d}-{rng.randint(1, 28):02d}',
+            hours=rng.choice([0.5, 1, 1.5, 2, 3, 4, 8]),
+            title=rng.choice(TITLES),
+            notes=rng.choice(['', '', 'Follow up next week', 'Blocked on review'])
+        )) for project in (rng.choice(projects) for _ in range(tasks_per_month))])
+
+    for _ in range(recurring):
+        project = rng.choice(projects)
+        year, month = rng.choice(months)
+        storage.save_task(Task(
+            project_id=project.id,
+            client_id=project.client_id,
+            date=f'{year}-{month:02d}-{rng.randint(1, 28):02d}',
+            hours=1,
+            title=rng.choice(TITLES),
+            recurring=rng.choice(['daily', 'weekly', 'monthly'])
+        ))
+
+    storage.close()
+    return months
+
+
+def timed(repeat, run, setup=None):
+    """Time run() repeat times, calling setup() untimed before each, and summarize in milliseconds."""
+    samples = []
+    for i in range(repeat):
+        argument = setup(i) if setup else i
+        start = time.perf_counter()
+        run(argument)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'runs': repeat,
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'p50_ms': round(samples[len(samples) // 2], 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'min_ms': round(samples[0], 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+
+def scenarios(storage, cold, client, months, rng):
+    """The timed scenarios, by name: (setup or None, run)."""
+    projects = storage.load_projects()
+    pick_month = lambda i: months[i % len(months)]
+
+    def some_task(i):
+        tasks = storage.load_month(*pick_month(i))['tasks']
+        return rng.choice([t for t in tasks if not t.recurring] or tasks)
+
+    def new_task(i):
+        year, month = pick_month(i)
+        project = rng.choice(projects)
+        return Task(project_id=project.id, client_id=project.client_id, date=f'{year}-{month:02d}-15',
+                    hours=1, title='Benchmark task')
+
+    def some_series(i):
+        series = [s for s in storage.load_recurring_tasks() if not s.deleted]
+        return rng.choice(series) if series else None
+
+    def edit_series(series):
+        if series:
+            storage.update_task(replace(series, id=series.id, hours=series.hours + 1, recurring=series.recurring))
+
+    def warm_month(i):
+        # Loaded untimed first, so the timed load is a cache hit
+        month = pick_month(i % 12)
+        storage.load_month(*month)
+        return month
+
+    last_year = months[-1][0]
+    return {
+        'load_month_warm': (warm_month, lambda month: storage.load_month(*month)),
+        'load_month_cold': (None, lambda i: cold.load_month(*pick_month(i))),
+        'save_task': (new_task, storage.save_task),
+        'update_task': (some_task, lambda t: storage.update_task(replace(t, hours=t.hours + 0.5))),
+        'delete_task': (some_task, lambda t: storage.delete_task(t.id)),
+        'batch_create_100': (lambda i: [('create', new_task(i + n)) for n in range(100)], storage.apply_batch),
+        'edit_recurring_series': (some_series, edit_series),
+        'summarize_year': (None, lambda i: storage.summarize(f'{last_year}-01-01', f'{last_year}-12-31', 'project')),
+        'export_year': (None, lambda i: sum(1 for _ in storage.export_rows(f'{last_year}-01-01', f'{last_year}-12-31'))),
+        'http_get_month': (None, lambda i: client.get('/api/tasks/%d/%d' % pick_month(i))),
+        'http_get_projects': (None, lambda i: client.get('/api/projects')),
+        'http_summary_year': (None, lambda i: client.get(f'/api/summary?from={last_year}-01-01&to={last_year}-12-31')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--clients', type=int, default=5)
+    parser.add_argument('--projects-per-client', type=int, default=3)
+    parser.add_argument('--rate-changes', type=int, default=2, help='rate changes per project')
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--tasks-per-month', type=int, default=100)
+    parser.add_argument('--recurring', type=int, default=5, help='recurring series')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per scenario')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenarios', help='comma-separated scenario names (default: all)')
+    parser.add_argument('--data', help='directory to generate into (default: a temporary one)')
+    parser.add_argument('--output', help='write the results here instead of stdout')
+    args = parser.parse_args()
+
+    root = args.data or tempfile.mkdtemp(prefix='tasklord-bench-')
+    path = os.path.join(root, 'data')
+    start = time.perf_counter()
+    months = generate(path, args.backend, args.clients, args.projects_per_client, args.rate_changes,
+                      args.years, args.tasks_per_month, args.recurring, seed=args.seed)
+    generate_seconds = time.perf_counter() - start
+
+    # The app opens TASKLORD_DATA when imported
+    os.environ['TASKLORD_STORAGE'] = args.backend
+    os.environ['TASKLORD_DATA'] = path
+    from app import app, default_profile
+
+    cold = open_storage(args.backend, path, month_cache_size=0)
+    rng = random.Random(args.seed)
+    available = scenarios(default_profile.storage, cold, app.test_client(), months, rng)
+    names = args.scenarios.split(',') if args.scenarios else list(available)
+
+    results = {}
+    for name in names:
+        setup, run = available[name]
+        results[name] = timed(args.repeat, run, setup)
+
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'data')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'generate_seconds': round(generate_seconds, 3),
+        'results': results
+    }
+    content = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content + '\n')
+    else:
+        print(content)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
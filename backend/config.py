@@ -0,0 +1,61 @@
+"""Runtime configuration, read from TASKLORD_* environment variables."""
+import os
+
+
+def _int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _bool(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+# Server
+HOST = os.environ.get('TASKLORD_HOST', '127.0.0.1')
+PORT = _int('TASKLORD_PORT', 3000)
+
+# Production (gunicorn) worker pool; every worker keeps its own Storage caches
+WORKERS = _int('TASKLORD_WORKERS', 2)
+THREADS = _int('TASKLORD_THREADS', 8)
+KEEPALIVE = _int('TASKLORD_KEEPALIVE', 5)
+TIMEOUT = _int('TASKLORD_TIMEOUT', 30)
+GRACEFUL_TIMEOUT = _int('TASKLORD_GRACEFUL_TIMEOUT', 30)
+ACCESS_LOG = os.environ.get('TASKLORD_ACCESS_LOG') or None
+
+# Storage
+# Data directory; backend/data by default, whatever the working directory
+DATA_PATH = os.path.abspath(os.environ.get('TASKLORD_DATA') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+# 'json' (files under data/) or 'sqlite' (one database, see migrate_sqlite.py)
+STORAGE = os.environ.get('TASKLORD_STORAGE', 'json')
+SQLITE_PATH = os.environ.get('TASKLORD_SQLITE_PATH') or None
+MONTH_CACHE_SIZE = _int('TASKLORD_MONTH_CACHE_SIZE', 24)
+# Cross-check incrementally maintained month summaries against a full recompute
+VERIFY_SUMMARIES = _bool('TASKLORD_VERIFY_SUMMARIES')
+# Indent the JSON data files; compact by default
+PRETTY_JSON = _bool('TASKLORD_PRETTY_JSON')
+# Append task, project and client changes to a journal instead of rewriting whole files,
+# folding it into the files every JOURNAL_COMPACT_INTERVAL seconds or JOURNAL_MAX_RECORDS changes
+JOURNAL = _bool('TASKLORD_JOURNAL', True)
+JOURNAL_COMPACT_INTERVAL = _int('TASKLORD_JOURNAL_COMPACT_INTERVAL', 30)
+JOURNAL_MAX_RECORDS = _int('TASKLORD_JOURNAL_MAX_RECORDS', 1000)
+# Longest range, in calendar months, that /api/summary, /api/export and the recurring
+# occurrences answer for; range summaries keep a rollup for at most this many months
+MAX_RANGE_MONTHS = _int('TASKLORD_MAX_RANGE_MONTHS', 240)
+# Changes kept for /api/changes; clients further behind reload everything
+CHANGE_LOG_SIZE = _int('TASKLORD_CHANGE_LOG_SIZE', 10000)
+# Keep a pickled copy of the projects, clients and recurring tasks for a faster first load
+ENTITY_SNAPSHOT = _bool('TASKLORD_ENTITY_SNAPSHOT')
+# Profiles: data directories under PROFILES_PATH, served under /p/<name>/ or with an
+# X-TaskLord-Profile header; up to PROFILES_OPEN are kept open per worker besides those in use
+PROFILES_PATH = os.path.abspath(os.environ.get('TASKLORD_PROFILES') or os.path.join(DATA_PATH, 'profiles'))
+PROFILES_OPEN = _int('TASKLORD_PROFILES_OPEN', 4)
+# Drop deleted recurring series, and those that ended RECURRING_RETENTION_DAYS ago, every
+# RECURRING_GC_HOURS hours (0 to only do it with gc_recurring.py)
+RECURRING_GC_HOURS = _int('TASKLORD_RECURRING_GC_HOURS', 24)
+RECURRING_RETENTION_DAYS = _int('TASKLORD_RECURRING_RETENTION_DAYS', 365)
+# Memory for logos and their renditions kept in memory per worker, in megabytes
+LOGO_CACHE_SIZE = _int('TASKLORD_LOGO_CACHE_MB', 16) * 1024 * 1024
+
+# Monitoring: /metrics in the Prometheus text format, and a Server-Timing header on every response
+METRICS = _bool('TASKLORD_METRICS', True)
+SERVER_TIMING = _bool('TASKLORD_SERVER_TIMING')
@@ -0,0 +1,43 @@
+"""Drop deleted and long-ended recurring series and report what was reclaimed.
+
+The server does the same every TASKLORD_RECURRING_GC_HOURS; run this to do it
+now, or with --dry-run to see what would go. Safe to run next to the server.
+
+    python gc_recurring.py --retention-days 365 --dry-run
+"""
+import argparse
+import json
+from datetime import date, timedelta
+
+import config
+from sqlite_storage import SQLiteStorage
+from storage import Storage
+
+
+def ended_before(retention_days):
+    """The date before which ended series are dropped, for a retention in days."""
+    return (date.today() - timedelta(days=retention_days)).isoformat()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=config.DATA_PATH, help='data directory (default: TASKLORD_DATA or backend/data)')
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default=config.STORAGE)
+    parser.add_argument('--retention-days', type=int, default=config.RECURRING_RETENTION_DAYS,
+                        help='keep series that ended less than this many days ago')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be dropped')
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite':
+        storage = SQLiteStorage(args.data, db_path=config.SQLITE_PATH)
+    else:
+        storage = Storage(args.data, journal=config.JOURNAL)
+    try:
+        report = storage.collect_recurring_garbage(ended_before(args.retention_days), dry_run=args.dry_run)
+    finally:
+        storage.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
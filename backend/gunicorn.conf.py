@@ -0,0 +1,29 @@
+"""Gunicorn settings for TaskLord, driven by config.py.
+
+Workers are forked before the app is imported (no preload), so every worker
+opens its own Storage; they coordinate through the lock files in data/locks.
+Send SIGHUP to the master (systemctl --user reload tasklord) to gracefully
+replace the workers after a code or config change.
+"""
+import logging
+
+from config import (ACCESS_LOG, GRACEFUL_TIMEOUT, HOST, KEEPALIVE, PORT, THREADS,
+                    TIMEOUT, WORKERS)
+
+bind = f'{HOST}:{PORT}'
+workers = WORKERS
+threads = THREADS
+worker_class = 'gthread'
+keepalive = KEEPALIVE
+timeout = TIMEOUT
+graceful_timeout = GRACEFUL_TIMEOUT
+preload_app = False
+
+accesslog = ACCESS_LOG
+errorlog = '-'
+
+
+def on_starting(server):
+    # Keep health checks and metrics scrapes out of the access log, like the dev server does
+    logging.getLogger('gunicorn.access').addFilter(
+        lambda record: '/health' not in record.getMessage() and '/metrics' not in record.getMessage())
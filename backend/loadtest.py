@@ -0,0 +1,107 @@
+"""Small HTTP load test for comparing server modes.
+
+Replays the requests the frontend makes when browsing the calendar
+(month tasks, clients, projects) from several concurrent clients and
+reports throughput and latency percentiles.
+
+    python loadtest.py --url http://127.0.0.1:3000 --concurrency 16 --duration 20
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _request(url, data=None):
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'} if body else {})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return response.read()
+
+
+def seed(base_url, months, tasks_per_month):
+    """Create a client, a project and some tasks to browse."""
+    boundary = 'loadtest'
+    body = f'--{boundary}\r\nContent-Disposition: form-data; name="name"\r\n\r\nLoad test\r\n--{boundary}--\r\n'.encode()
+    req = urllib.request.Request(f'{base_url}/api/clients', data=body,
+                                 headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(req) as response:
+        client_id = json.load(response)['id']
+
+    project_id = json.loads(_request(f'{base_url}/api/projects', {
+        'name': 'Load test', 'client_id': client_id, 'color': '#888888',
+        'rate_changes': [{'hourly_rate': 50, 'effective_date': None}]
+    }))['id']
+
+    for month in months:
+        for i in range(tasks_per_month):
+            _request(f'{base_url}/api/tasks', {
+                'project_id': project_id, 'client_id': client_id,
+                'date': f'{month[0]}-{month[1]:02d}-{i % 28 + 1:02d}',
+                'hours': 1, 'title': f'Task {i}', 'notes': ''
+            })
+
+
+def run(base_url, months, concurrency, duration):
+    """Hammer the read endpoints for duration seconds and collect latencies."""
+    paths = [f'/api/tasks/{year}/{month}' for year, month in months] + ['/api/clients', '/api/projects']
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        nonlocal errors
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                _request(base_url + paths[i % len(paths)])
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except Exception:
+                with lock:
+                    errors += 1
+            i += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for n in range(concurrency):
+            pool.submit(worker, n)
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(0.50), 2),
+        'p95_ms': round(percentile(0.95), 2),
+        'p99_ms': round(percentile(0.99), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:3000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--year', type=int, default=2020, help='year to seed and browse')
+    parser.add_argument('--tasks-per-month', type=int, default=60)
+    parser.add_argument('--seed', action='store_true', help='create test data before measuring')
+    args = parser.parse_args()
+
+    months = [(args.year, month) for month in range(1, 13)]
+    if args.seed:
+        seed(args.url, months, args.tasks_per_month)
+
+    print(json.dumps(run(args.url, months, args.concurrency, args.duration), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Client logo renditions and serving.
+
+Uploaded logos are stored under a name derived from their content, so a new
+logo gets a new URL and every URL can be cached forever. Fixed-size PNG
+renditions for the places a logo is shown small are generated in a background
+thread (if Pillow is installed) and requested with ?size=; until one exists
+the original is served in its place. Served files are kept in a bounded
+in-memory cache.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+
+from flask import Response, request
+from werkzeug.utils import secure_filename
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: originals only
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Rendition name -> longest side in pixels (twice the largest size it is shown at)
+RENDITIONS = {'small': 64, 'medium': 256}
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def logo_filename(client_id, content, name):
+    """Content-addressed filename for an uploaded logo, keeping its extension."""
+    extension = os.path.splitext(name or '')[1].lower()
+    return secure_filename(f"{client_id}_{hashlib.sha256(content).hexdigest()[:16]}{extension}")
+
+
+class Logos:
+    # Whether the missing Pillow was reported; once per process, not per profile
+    _warned = False
+
+    def __init__(self, logos_path, renditions_path, cache_size=16 * 1024 * 1024):
+        self.logos_path = logos_path
+        self.renditions_path = renditions_path
+        self.cache_size = cache_size
+        os.makedirs(renditions_path, exist_ok=True)
+        if Image is None and not Logos._warned:
+            Logos._warned = True
+            logger.warning("Pillow is not installed, so logos are served without renditions (see install.sh)")
+
+        self._lock = threading.Lock()
+        # (path, mtime, size) -> (content, etag), least recently served first
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._pending = set()
+        self._failed = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='logos')
+        self.hits = 0
+        self.misses = 0
+
+    # Renditions
+
+    def _rendition_path(self, filename, size):
+        return os.path.join(self.renditions_path, f"{os.path.splitext(filename)[0]}-{size}.png")
+
+    def render_async(self, filename):
+        """Queue the renditions of a logo to be generated, unless they are being or cannot be."""
+        if Image is None:
+            return
+        with self._lock:
+            if filename in self._pending or filename in self._failed:
+                return
+            self._pending.add(filename)
+        self._executor.submit(self._render, filename)
+
+    def _render(self, filename):
+        try:
+            with Image.open(os.path.join(self.logos_path, filename)) as original:
+                image = ImageOps.exif_transpose(original).convert('RGBA')
+            for size, pixels in RENDITIONS.items():
+                rendition = image.copy()
+                rendition.thumbnail((pixels, pixels), Image.LANCZOS)
+                buffer = io.BytesIO()
+                rendition.save(buffer, 'PNG', optimize=True)
+                self._write(self._rendition_path(filename, size), buffer.getvalue())
+            self._prune()
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # Not an image Pillow can read (SVG, for one); the original stands in
+            logger.warning("Could not render logo %s", filename, exc_info=True)
+            with self._lock:
+                self._failed.add(filename)
+        finally:
+            with self._lock:
+                self._pending.discard(filename)
+
+    def _write(self, path, content):
+        fd, tmp_path = tempfile.mkstemp(dir=self.renditions_path, prefix='.rendition.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _prune(self):
+        """Remove the renditions of logos that were replaced or deleted."""
+        stems = {os.path.splitext(filename)[0] for filename in os.listdir(self.logos_path)}
+        for filename in os.listdir(self.renditions_path):
+            if filename.endswith('.png') and filename[:-4].rsplit('-', 1)[0] not in stems:
+                os.remove(os.path.join(self.renditions_path, filename))
+
+    # Serving
+
+    def _read(self, path):
+        """Content and ETag of a file, from the cache if it has not changed. None if there is no such file."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (path, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        entry = (content, hashlib.sha1(content).hexdigest()[:20])
+
+        # Logos bigger than a quarter of the cache are served from disk every time
+        if len(content) <= self.cache_size // 4:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = entry
+                    self._cache_bytes += len(content)
+                while self._cache_bytes > self.cache_size:
+                    _, (evicted, _) = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted)
+        return entry
+
+    def response(self, filename, size=None):
+        """Build the response for a logo or one of its renditions, None if there is no such logo."""
+        if filename != secure_filename(filename):
+            return None
+
+        rendition = self._read(self._rendition_path(filename, size)) if size else None
+        entry = rendition or self._read(os.path.join(self.logos_path, filename))
+        if entry is None:
+            return None
+        stand_in = size and rendition is None
+        if stand_in:
+            self.render_async(filename)
+
+        content, etag = entry
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            mimetype = 'image/png' if rendition else mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = Response(content, mimetype=mimetype)
+        response.set_etag(etag)
+        # The original stands in for a missing rendition only until it exists, so it must not be cached for good
+        response.headers['Cache-Control'] = 'no-cache' if stand_in else IMMUTABLE
+        return response
+
+    def close(self):
+        """Stop generating renditions; queued ones are made again when next requested."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def cache_stats(self):
+        with self._lock:
+            return {
+                'logo_cache_entries': len(self._cache),
+                'logo_cache_bytes': self._cache_bytes,
+                'logo_cache_hits': self.hits,
+                'logo_cache_misses': self.misses
+            }
@@ -0,0 +1,93 @@
+"""Memory benchmark for the Task representation.
+
+Builds the same tasks as a month file load would, once with a copy of the
+previous plain dataclass and once with the current slotted, interned Task,
+and reports the bytes held per task as JSON.
+
+    python membench.py --tasks 100000
+"""
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+from models import Task
+
+
+@dataclass
+class LegacyTask:
+    """Task as it was before it was slotted and interned."""
+    project_id: str
+    client_id: str
+    date: str
+    hours: float
+    title: str
+    notes: str = ""
+    recurring: Optional[str] = None
+    id: str = None
+    deleted: bool = False
+
+
+def month_files(count, projects, seed=1):
+    """Serialized tasks spread over the months since 2015, like the month files hold them."""
+    rng = random.Random(seed)
+    clients = [f"{rng.getrandbits(128):032x}" for _ in range(max(1, projects // 4))]
+    project_clients = [(f"{rng.getrandbits(128):032x}", rng.choice(clients)) for _ in range(projects)]
+    titles = ['Standup', 'Code review', 'Planning', 'Support', 'Deployment', 'Design']
+
+    tasks = []
+    for _ in range(count):
+        project_id, client_id = rng.choice(project_clients)
+        tasks.append({
+            'id': f"{rng.getrandbits(128):032x}",
+            'project_id': project_id,
+            'client_id': client_id,
+            'date': (date(2015, 1, 1) + timedelta(days=rng.randrange(3650))).isoformat(),
+            'hours': rng.choice([0.5, 1, 1.5, 2, 4, 8]),
+            'title': rng.choice(titles),
+            'notes': '',
+            'recurring': rng.choice([None] * 9 + ['weekly']),
+            'deleted': False
+        })
+    return json.dumps(tasks)
+
+
+def measure(cls, content):
+    """Bytes allocated by the task objects built from serialized tasks."""
+    gc.collect()
+    tracemalloc.start()
+    # Parsed dicts are dropped as they are turned into tasks, like a month load
+    tasks = [cls(**item) for item in json.loads(content)]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tasks
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=100000)
+    parser.add_argument('--projects', type=int, default=20)
+    args = parser.parse_args()
+
+    content = month_files(args.tasks, args.projects)
+    legacy = measure(LegacyTask, content)
+    compact = measure(Task, content)
+
+    print(json.dumps({
+        'tasks': args.tasks,
+        'legacy_bytes': legacy,
+        'compact_bytes': compact,
+        'legacy_bytes_per_task': round(legacy / args.tasks, 1),
+        'compact_bytes_per_task': round(compact / args.tasks, 1),
+        'saved_percent': round(100 * (1 - compact / legacy), 1)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
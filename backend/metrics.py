@@ -0,0 +1,117 @@
+"""Request latency histograms and storage counters in the Prometheus text format.
+
+Every worker process keeps its own numbers, so with several workers each scrape
+of /metrics reports the worker that answered it.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (route, method) -> [count per bucket..., count above the last], sum of seconds
+        self._latency = {}
+        self._latency_sums = {}
+        # (route, method, status) -> requests
+        self._requests = {}
+        # Startup phase -> seconds, in the order they ran
+        self.startup_phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of startup."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_phases[name] = time.perf_counter() - start
+
+    def startup_report(self):
+        """The startup phases and their times, for the log."""
+        total = sum(self.startup_phases.values())
+        phases = ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in self.startup_phases.items())
+        return f'{phases} (total {total * 1000:.1f} ms)'
+
+    def observe(self, route, method, status, seconds):
+        """Record one request."""
+        key = (route, method)
+        with self._lock:
+            counts = self._latency.get(key)
+            if counts is None:
+                counts = self._latency[key] = [0] * (len(self.buckets) + 1)
+            counts[bisect_left(self.buckets, seconds)] += 1
+            self._latency_sums[key] = self._latency_sums.get(key, 0) + seconds
+            self._requests[key + (status,)] = self._requests.get(key + (status,), 0) + 1
+
+    def render(self, storage, *caches):
+        """Render the request metrics, the storage's counters and the storage's and other caches' statistics."""
+        lines = []
+
+        with self._lock:
+            latency = {key: list(counts) for key, counts in self._latency.items()}
+            sums = dict(self._latency_sums)
+            requests = dict(self._requests)
+
+        lines += [
+            '# HELP tasklord_request_duration_seconds Time to build a response, by route.',
+            '# TYPE tasklord_request_duration_seconds histogram'
+        ]
+        for (route, method), counts in sorted(latency.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                lines.append(f'tasklord_request_duration_seconds_bucket{_labels(route=route, method=method, le=bound)} {total}')
+            lines.append(f'tasklord_request_duration_seconds_sum{_labels(route=route, method=method)} {sums[route, method]:.6f}')
+            lines.append(f'tasklord_request_duration_seconds_count{_labels(route=route, method=method)} {total}')
+
+        lines += [
+            '# HELP tasklord_requests_total Requests answered, by route and status.',
+            '# TYPE tasklord_requests_total counter'
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(f'tasklord_requests_total{_labels(route=route, method=method, status=status)} {count}')
+
+        for name, value in sorted(storage.io_stats().items()):
+            lines += [f'# TYPE tasklord_storage_{name}_total counter', f'tasklord_storage_{name}_total {value}']
+
+        cache = storage.cache_stats()
+        for stats in caches:
+            cache.update(stats)
+        for name, value in sorted(cache.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines += [f'# TYPE tasklord_cache_{name} gauge', f'tasklord_cache_{name} {value}']
+        # Hit rates for every hits/misses pair, like month_cache hits and misses
+        for name in sorted(cache):
+            if name.endswith('hits') and name[:-4] + 'misses' in cache:
+                hits, misses = cache[name], cache[name[:-4] + 'misses']
+                ratio = hits / (hits + misses) if hits + misses else 0
+                lines += [f'# TYPE tasklord_cache_{name[:-4]}hit_ratio gauge',
+                          f'tasklord_cache_{name[:-4]}hit_ratio {ratio:.4f}']
+
+        # The storage's phases run on first use rather than at startup
+        phases = {**self.startup_phases, **{f'storage_{name}': seconds for name, seconds in storage.startup_phases.items()}}
+        lines += [
+            '# HELP tasklord_startup_seconds Time taken by each phase of startup.',
+            '# TYPE tasklord_startup_seconds gauge'
+        ]
+        for name, seconds in phases.items():
+            lines.append(f'tasklord_startup_seconds{_labels(phase=name)} {seconds:.6f}')
+
+        lines += ['# TYPE tasklord_process_id gauge', f'tasklord_process_id {os.getpid()}']
+        return '\n'.join(lines) + '\n'
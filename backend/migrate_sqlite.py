@@ -0,0 +1,54 @@
+"""Copy the JSON data directory into a SQLite database for TASKLORD_STORAGE=sqlite.
+
+Pending journal records are folded into the JSON files first; the JSON data
+itself is left untouched, so switching back only means unsetting the variable.
+
+    python migrate_sqlite.py --data data --db data/tasklord.db
+"""
+import argparse
+import os
+import shutil
+
+import config
+from sqlite_storage import SQLiteStorage
+from storage import Storage
+
+
+def migrate(data_path, db_path, force=False):
+    """Copy everything under data_path into a new database at db_path."""
+    if os.path.exists(db_path):
+        if not force:
+            raise SystemExit(f'{db_path} already exists, pass --force to replace it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    source = Storage(data_path, journal=False)
+    target = SQLiteStorage(os.path.dirname(db_path) or '.', db_path=db_path)
+    try:
+        count = target.import_storage(source)
+    finally:
+        target.close()
+        source.close()
+
+    # Logos stay files; copy them when the database lives elsewhere
+    if os.path.abspath(target.logos_path) != os.path.abspath(source.logos_path):
+        shutil.copytree(source.logos_path, target.logos_path, dirs_exist_ok=True)
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=config.DATA_PATH, help='JSON data directory (default: TASKLORD_DATA or backend/data)')
+    parser.add_argument('--db', default=None, help='database file (default: <data>/tasklord.db)')
+    parser.add_argument('--force', action='store_true', help='replace an existing database')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(args.data, 'tasklord.db')
+    count = migrate(args.data, db_path, args.force)
+    print(f'Copied {count} stored tasks to {db_path}')
+
+
+if __name__ == '__main__':
+    main()
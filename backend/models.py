@@ -1,24 +1,32 @@
-from dataclasses import dataclass
+from bisect import bisect_right
+from dataclasses import dataclass, field, replace
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
+import sys
 import uuid
 
+from recurrence import occurrences, parse_date
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
 
 @dataclass
 class RateChange:
     hourly_rate: float
     effective_date: Optional[str] = None  # YYYY-MM-DD format, None for original rate
 
-    @property
-    def __dict__(self):
+    def to_dict(self):
         return {
             "hourly_rate": self.hourly_rate,
             "effective_date": self.effective_date
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Task:
+    """A time entry. Slotted, with its ids, date and repeat rule interned, as there can be many."""
     project_id: str
     client_id: str
     date: str
@@ -32,9 +40,13 @@ class Task:
     def __post_init__(self):
         if not self.id:
             self.id = str(uuid.uuid4())
+        # Repeated across thousands of tasks; share one copy of each
+        self.project_id = _intern(self.project_id)
+        self.client_id = _intern(self.client_id)
+        self.date = _intern(self.date)
+        self.recurring = _intern(self.recurring)
 
-    @property
-    def __dict__(self):
+    def to_dict(self):
         return {
             "id": self.id,
             "project_id": self.project_id,
@@ -59,6 +71,118 @@ class Task:
         self.recurring = task.recurring
 
 
+@dataclass(slots=True)
+class RecurringTask(Task):
+    """A recurring series: the task it started as, plus edits, skips and an end.
+
+    Every change is dated and bumps the revision. An edit replaces the task fields
+    from its date onwards, so an occurrence takes the fields of the last edit dated
+    on or before it. Month files remember the revision they reflect and only the
+    dates changed since then need patching.
+    """
+    until: Optional[str] = None  # Last date of the series, None while open-ended
+    revision: int = 0
+    changes: List[dict] = field(default_factory=list)
+    skipped_dates: List[str] = field(default_factory=list)
+
+    FIELDS = ('project_id', 'client_id', 'hours', 'title', 'notes')
+
+    def to_dict(self):
+        return {
+            **Task.to_dict(self),
+            "until": self.until,
+            "revision": self.revision,
+            "changes": self.changes,
+            "skipped_dates": self.skipped_dates
+        }
+
+    @classmethod
+    def start(cls, task):
+        """Start a new series from a task."""
+        return cls(
+            id=task.id,
+            project_id=task.project_id,
+            client_id=task.client_id,
+            date=task.date,
+            hours=task.hours,
+            title=task.title,
+            notes=task.notes,
+            recurring=task.recurring,
+            revision=1,
+            changes=[{"type": "create", "revision": 1, "from": task.date}]
+        )
+
+    def copy(self):
+        return replace(self, changes=[dict(c) for c in self.changes], skipped_dates=list(self.skipped_dates))
+
+    def _add_change(self, change):
+        self.revision += 1
+        self.changes.append({**change, "revision": self.revision})
+        self.changes.sort(key=lambda c: c["from"])
+
+    def edit(self, task, from_date):
+        """Apply the fields of a task to all occurrences from a date on.
+
+        Raises:
+            ValueError: If the task repeats differently; a series keeps its repeat rule
+        """
+        if task.recurring != self.recurring:
+            raise ValueError("a recurring task cannot change how often it repeats; end it and create a new one")
+        # Earlier edits are fully superseded from this date on
+        self.changes = [c for c in self.changes if c["type"] != "edit" or c["from"] < from_date]
+        self._add_change({"type": "edit", "from": from_date, **{name: getattr(task, name) for name in self.FIELDS}})
+
+    def end(self, from_date):
+        """End the series before a date."""
+        last_date = (parse_date(from_date) - timedelta(days=1)).isoformat()
+        self.until = min(self.until, last_date) if self.until else last_date
+        if self.until < self.date:
+            self.deleted = True
+        self._add_change({"type": "end", "from": from_date})
+
+    def skip(self, date_str):
+        """Leave out a single occurrence."""
+        self.skipped_dates.append(date_str)
+        self._add_change({"type": "skip", "from": date_str})
+
+    def active_between(self, start, end):
+        """Check whether the series spans any of the dates between start and end (YYYY-MM-DD, inclusive).
+
+        Only compares the dates it starts and ends on, so a series that cannot
+        fall in a month is passed over without generating its dates.
+        """
+        return not self.deleted and self.date <= end and (self.until is None or self.until >= start)
+
+    def finished_before(self, date_str):
+        """Check whether the series was deleted or had its last occurrence before a date."""
+        return self.deleted or (self.until is not None and self.until < date_str)
+
+    def changed_since(self, revision):
+        """Get the earliest date affected by changes after a revision, None if nothing changed."""
+        return min((c["from"] for c in self.changes if c["revision"] > revision), default=None)
+
+    def fields_on(self, date_str):
+        """Get the task fields of the occurrence on a date."""
+        fields = {name: getattr(self, name) for name in self.FIELDS}
+        for change in self.changes:
+            if change["from"] > date_str:
+                break
+            if change["type"] == "edit":
+                fields = {name: change[name] for name in self.FIELDS}
+        return fields
+
+    def occurrences(self, start, end):
+        """Yield the dates of live occurrences between start and end (inclusive)."""
+        if self.deleted:
+            return
+        if self.until:
+            end = min(end, parse_date(self.until))
+
+        for day in occurrences(self, start, end):
+            if not self.skipped_dates or day.isoformat() not in self.skipped_dates:
+                yield day
+
+
 @dataclass
 class Project:
     name: str
@@ -74,15 +198,26 @@ class Project:
         # Convert dict list to RateChange objects if needed
         if self.rate_changes and isinstance(self.rate_changes[0], dict):
             self.rate_changes = [RateChange(**rc) for rc in self.rate_changes]
+        self._build_rate_timeline()
 
-    @property
-    def __dict__(self):
+    def _build_rate_timeline(self):
+        # Kept out of the dataclass fields so it never reaches the JSON output:
+        # effective dates ("" for the original rate) ascending, and the rate from each date on.
+        # Sort rate changes: None (original) first, then by date ascending
+        sorted_rates = sorted(
+            self.rate_changes,
+            key=lambda r: r.effective_date or ""
+        )
+        self._rate_dates = [r.effective_date or "" for r in sorted_rates]
+        self._rate_values = [r.hourly_rate for r in sorted_rates]
+
+    def to_dict(self):
         return {
             "id": self.id,
             "name": self.name,
             "client_id": self.client_id,
             "color": self.color,
-            "rate_changes": [rc.__dict__ for rc in self.rate_changes],
+            "rate_changes": [rc.to_dict() for rc in self.rate_changes],
             "hidden": self.hidden
         }
 
@@ -95,21 +230,30 @@ class Project:
         Returns:
             The hourly rate effective on that date
         """
-        # Sort rate changes: None (original) first, then by date ascending
-        sorted_rates = sorted(
-            self.rate_changes,
-            key=lambda r: r.effective_date or ""
-        )
+        # Last change effective on or before the date, defaulting to the earliest
+        index = bisect_right(self._rate_dates, date_str) - 1
+        return self._rate_values[max(index, 0)]
 
-        applicable_rate = sorted_rates[0].hourly_rate  # Default to original
+    def price(self, entries):
+        """Price a batch of entries in one walk over the rate timeline.
 
-        for rate_change in sorted_rates:
-            if rate_change.effective_date is None or rate_change.effective_date <= date_str:
-                applicable_rate = rate_change.hourly_rate
-            else:
-                break  # Future rate, stop looking
+        Args:
+            entries: (date, hours) pairs, dates in YYYY-MM-DD format
+
+        Returns:
+            The amounts, in the order of the entries
+        """
+        entries = list(entries)
+        amounts = [0.0] * len(entries)
+        position = 0
 
-        return applicable_rate
+        for i in sorted(range(len(entries)), key=lambda i: entries[i][0]):
+            date_str, hours = entries[i]
+            while position + 1 < len(self._rate_dates) and self._rate_dates[position + 1] <= date_str:
+                position += 1
+            amounts[i] = hours * self._rate_values[position]
+
+        return amounts
 
     @property
     def current_rate(self) -> float:
@@ -122,6 +266,7 @@ class Project:
         self.color = project.color
         self.rate_changes = project.rate_changes
         self.hidden = project.hidden
+        self._build_rate_timeline()
 
 
 @dataclass
@@ -134,8 +279,7 @@ class Client:
         if not self.id:
             self.id = str(uuid.uuid4())
 
-    @property
-    def __dict__(self):
+    def to_dict(self):
         return {
             "id": self.id,
             "name": self.name,
@@ -146,3 +290,27 @@ class Client:
         self.name = client.name
         if client.logo_path:
             self.logo_path = client.logo_path
+
+
+def price_rows(rows):
+    """Price a batch of (project, date, hours) rows, one pass per project.
+
+    Rows whose project no longer exists (None) are priced at 0.
+
+    Returns:
+        The amounts, in the order of the rows
+    """
+    rows = list(rows)
+    amounts = [0.0] * len(rows)
+
+    batches = {}
+    for i, (project, date_str, hours) in enumerate(rows):
+        if project is None:
+            continue
+        batches.setdefault(project.id, (project, []))[1].append((i, date_str, hours))
+
+    for project, batch in batches.values():
+        for (i, _, _), amount in zip(batch, project.price((d, h) for _, d, h in batch)):
+            amounts[i] = amount
+
+    return amounts
@@ -0,0 +1,147 @@
+"""Several isolated data directories served by one process.
+
+A request picks a profile with a /p/<name>/ URL prefix or an X-TaskLord-Profile
+header; without either it gets the default data directory. Each profile is a
+directory under the profiles root with its own storage, search index and logos,
+opened on the first request for it. A bounded number are kept open, and the
+least recently used idle ones are closed to make room.
+"""
+from collections import OrderedDict
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+PREFIX = '/p/'
+HEADER = 'X-TaskLord-Profile'
+ENVIRON_KEY = 'tasklord.profile'
+
+NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9_-]{0,63}')
+
+
+class Profile:
+    __slots__ = ('name', 'storage', 'search_index', 'logos', 'users')
+
+    def __init__(self, name, storage, search_index, logos):
+        self.name = name
+        self.storage = storage
+        self.search_index = search_index
+        self.logos = logos
+        # Requests (and maintenance) using the profile; only unused profiles are closed
+        self.users = 0
+
+    def close(self):
+        """Save the search index, stop logo renditions and close the storage."""
+        self.search_index.save()
+        self.logos.close()
+        self.storage.close()
+
+
+class ProfileMiddleware:
+    """Move a /p/<name> prefix from the path into the WSGI environ, so routes do not see it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(PREFIX):
+            name, _, rest = path[len(PREFIX):].partition('/')
+            environ[ENVIRON_KEY] = name
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + PREFIX + name
+            environ['PATH_INFO'] = '/' + rest
+        return self.app(environ, start_response)
+
+
+def requested_profile(request):
+    """The profile name a request asks for, from its URL prefix or header. None for the default."""
+    return request.environ.get(ENVIRON_KEY) or request.headers.get(HEADER) or None
+
+
+class Profiles:
+    def __init__(self, root, open_profile, max_open=4):
+        """
+        Args:
+            root: Directory holding one data directory per profile
+            open_profile: Builds the Profile for a name and data directory
+            max_open: Profiles kept open at once, besides those in use
+        """
+        self.root = root
+        self.open_profile = open_profile
+        self.max_open = max_open
+
+        self._lock = threading.Lock()
+        # Name -> Profile, least recently used first
+        self._open = OrderedDict()
+        self.opened = 0
+        self.evicted = 0
+
+    def acquire(self, name):
+        """Open a profile, or reuse the open one, and mark it in use. None if there is no such profile."""
+        if not NAME.fullmatch(name or ''):
+            return None
+        path = os.path.join(self.root, name)
+
+        with self._lock:
+            profile = self._open.get(name)
+            if profile is None:
+                # Profiles are created by making their directory, never by a request
+                if not os.path.isdir(path):
+                    return None
+                # Opening reads no data; that happens on the profile's first request
+                profile = self._open[name] = self.open_profile(name, path)
+                self.opened += 1
+            self._open.move_to_end(name)
+            profile.users += 1
+            evicted = self._evict()
+        self._close(evicted)
+        return profile
+
+    def release(self, profile):
+        """Mark a profile acquired earlier as no longer in use by the caller."""
+        with self._lock:
+            profile.users -= 1
+            evicted = self._evict()
+        self._close(evicted)
+
+    def names(self):
+        """Names of the open profiles."""
+        with self._lock:
+            return list(self._open)
+
+    def _evict(self):
+        """Take the least recently used idle profiles beyond max_open out. Caller must hold self._lock."""
+        evicted = []
+        for name, profile in list(self._open.items()):
+            if len(self._open) <= self.max_open:
+                break
+            if profile.users == 0:
+                del self._open[name]
+                evicted.append(profile)
+        self.evicted += len(evicted)
+        return evicted
+
+    def _close(self, profiles):
+        # Outside the lock: closing folds the journal into the files, which takes a while
+        for profile in profiles:
+            try:
+                profile.close()
+            except Exception:
+                logger.exception("Could not close profile %s", profile.name)
+
+    def close(self):
+        """Close every open profile, in use or not, when the process exits."""
+        with self._lock:
+            profiles = list(self._open.values())
+            self._open.clear()
+        self._close(profiles)
+
+    def cache_stats(self):
+        with self._lock:
+            return {
+                'profiles_open': len(self._open),
+                'profiles_opened': self.opened,
+                'profiles_evicted': self.evicted
+            }
@@ -0,0 +1,64 @@
+from calendar import monthrange
+from datetime import date, timedelta
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    """Parse a YYYY-MM-DD date. Cached, as series start dates are parsed for every month."""
+    return date.fromisoformat(value)
+
+
+def month_range(year, month):
+    """Get the first and last day of a month."""
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def months_between(start, end):
+    """Yield (year, month) of every month overlapping start..end (inclusive)."""
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def occurrences(task, start, end):
+    """Yield the dates a recurring task falls on between start and end (inclusive).
+
+    Jumps straight from one occurrence to the next instead of testing every day.
+
+    Args:
+        task: Recurring task, its date is the first occurrence
+        start: First date to consider
+        end: Last date to consider
+    """
+    anchor = parse_date(task.date)
+    first = max(start, anchor)
+    if first > end:
+        return
+
+    if task.recurring == 'daily':
+        step = timedelta(days=1)
+    elif task.recurring == 'weekly':
+        first += timedelta(days=(anchor.weekday() - first.weekday()) % 7)
+        step = timedelta(days=7)
+    elif task.recurring == 'monthly':
+        year, month = first.year, first.month
+        if first.day > anchor.day:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        while date(year, month, 1) <= end:
+            # Months too short for the anchor day are skipped
+            if anchor.day <= monthrange(year, month)[1]:
+                day = date(year, month, anchor.day)
+                if day > end:
+                    return
+                yield day
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return
+    else:
+        return
+
+    day = first
+    while day <= end:
+        yield day
+        day += step
@@ -0,0 +1,197 @@
+"""Full-text search over task titles and notes.
+
+An inverted index from words to task ids, kept in memory and saved next to the
+data. It follows the storage's change log, so it picks up changes made through
+any worker, and is rebuilt from the months only when the log has moved past it.
+
+Attached occurrences of a recurring task are not indexed one by one; the task
+that started the series stands for them.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from models import Task
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r'\w+')
+
+FIELDS = ('id', 'project_id', 'client_id', 'date', 'hours', 'title', 'notes', 'recurring')
+
+
+def tokenize(text):
+    """Split text into lowercase words."""
+    return WORD.findall(text.lower()) if text else []
+
+
+class SearchIndex:
+    def __init__(self, storage, path, save_interval=30):
+        self.storage = storage
+        self.path = path
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        self._seq = None
+        self._docs = {}       # Task id -> indexed fields
+        self._postings = {}   # Word -> task ids
+        self._dirty = False
+        self._saved_at = 0
+        self._loaded = False
+        self.rebuilds = 0
+
+    def _load(self):
+        """Read the saved index, if there is a usable one. Caller must hold self._lock."""
+        # On the first search rather than at startup
+        self._loaded = True
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("Ignoring unreadable search index %s", self.path)
+            return
+
+        for doc in saved['docs']:
+            self._add(doc)
+        self._seq = saved['seq']
+
+    def save(self):
+        """Write the index next to the data if it changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            content = json.dumps({'seq': self._seq, 'docs': list(self._docs.values())}, separators=(',', ':'))
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.search_index.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    # Index maintenance
+
+    def _add(self, doc):
+        self._docs[doc['id']] = doc
+        for word in set(tokenize(doc['title']) + tokenize(doc['notes'])):
+            self._postings.setdefault(word, set()).add(doc['id'])
+
+    def _remove(self, task_id):
+        doc = self._docs.pop(task_id, None)
+        if doc is None:
+            return
+        for word in set(tokenize(doc['title']) + tokenize(doc['notes'])):
+            ids = self._postings.get(word)
+            if ids is not None:
+                ids.discard(task_id)
+                if not ids:
+                    del self._postings[word]
+
+    def _put(self, task):
+        """Index a task, or drop it if it is an attached occurrence of a recurring task."""
+        self._remove(task.id)
+        if not (task.recurring and '_' in task.id):
+            self._add({name: getattr(task, name) for name in FIELDS})
+
+    def _rebuild(self):
+        """Index every saved task from scratch. Caller must hold self._lock."""
+        # Taken first: changes made while scanning are applied again on the next catch-up
+        seq = self.storage.change_seq()
+        self._docs = {}
+        self._postings = {}
+        for year, month in self.storage.stored_months():
+            for task in self.storage.load_month(year, month)['tasks']:
+                self._put(task)
+        self._seq = seq
+        self._dirty = True
+        self.rebuilds += 1
+
+    def _catch_up(self):
+        """Apply the changes logged since the index was last brought up to date. Caller must hold self._lock."""
+        if not self._loaded:
+            self._load()
+        if self._seq is None:
+            self._rebuild()
+            return
+
+        changes = self.storage.changes_since(self._seq)
+        if changes['reset']:
+            self._rebuild()
+            return
+        if changes['seq'] == self._seq:
+            return
+
+        for task in changes['tasks']['updated']:
+            self._put(task)
+        for task_id in changes['tasks']['deleted']:
+            self._remove(task_id)
+
+        # A series edit or end shows on the task that started it
+        for series in changes['recurring_tasks']['updated']:
+            doc = self._docs.get(series.id)
+            if doc and doc['recurring']:
+                self._remove(series.id)
+                if not series.deleted:
+                    self._add({**doc, **series.fields_on(series.date)})
+        # Dropped series (collect_recurring_garbage) report the task they started from as a task change
+
+        self._seq = changes['seq']
+        self._dirty = True
+
+    # Queries
+
+    def search(self, query, client_id=None, project_id=None, start=None, end=None, offset=0, limit=50):
+        """Find the tasks whose title or notes contain every word of a query.
+
+        Args:
+            query: Words to look for, in any order and case
+            client_id, project_id: Only tasks of this client or project
+            start, end: Only tasks between these dates (inclusive), YYYY-MM-DD
+            offset, limit: The page of results, newest first
+
+        Returns:
+            {'total', 'offset', 'limit', 'tasks'}
+        """
+        words = set(tokenize(query))
+
+        with self._lock:
+            self._catch_up()
+
+            matches = None
+            # Intersect from the rarest word on, so the candidate set only shrinks
+            for word in sorted(words, key=lambda w: len(self._postings.get(w, ()))):
+                ids = self._postings.get(word, set())
+                matches = ids.copy() if matches is None else matches & ids
+                if not matches:
+                    break
+
+            docs = [
+                self._docs[task_id] for task_id in matches or ()
+                if (client_id is None or self._docs[task_id]['client_id'] == client_id)
+                and (project_id is None or self._docs[task_id]['project_id'] == project_id)
+                and (start is None or self._docs[task_id]['date'] >= start)
+                and (end is None or self._docs[task_id]['date'] <= end)
+            ]
+            save = self._dirty and time.monotonic() - self._saved_at >= self.save_interval
+
+        if save:
+            self.save()
+
+        docs.sort(key=lambda d: (d['date'], d['id']), reverse=True)
+        return {
+            'total': len(docs),
+            'offset': offset,
+            'limit': limit,
+            'tasks': [Task(**doc) for doc in docs[offset:offset + limit]]
+        }
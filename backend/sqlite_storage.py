@@ -0,0 +1,837 @@
+"""SQLite storage backend with the same public methods as Storage.
+
+Tasks live in one table indexed by date, client and project, so a month or any
+date range is a single range query. Recurring series are stored once and their
+occurrences generated on read: the only task rows are plain tasks, the task a
+series started from and occurrences detached from their series.
+
+Select it with TASKLORD_STORAGE=sqlite after copying the JSON data over with
+migrate_sqlite.py.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from logos import logo_filename
+from models import Task, Project, Client, RecurringTask, price_rows
+from recurrence import month_range, months_between, parse_date
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    project_id TEXT,
+    client_id TEXT,
+    hours REAL,
+    title TEXT,
+    notes TEXT,
+    recurring TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    series_id TEXT,
+    series_revision INTEGER
+);
+CREATE INDEX IF NOT EXISTS tasks_date ON tasks (date);
+CREATE INDEX IF NOT EXISTS tasks_client_date ON tasks (client_id, date);
+CREATE INDEX IF NOT EXISTS tasks_project_date ON tasks (project_id, date);
+
+CREATE TABLE IF NOT EXISTS recurring_tasks (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS projects (id TEXT PRIMARY KEY, name TEXT NOT NULL, client_id TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS projects_client ON projects (client_id);
+CREATE TABLE IF NOT EXISTS clients (id TEXT PRIMARY KEY, name TEXT NOT NULL, data TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    month TEXT,
+    from_date TEXT
+);
+CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, seq INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+TASK_COLUMNS = ('id', 'date', 'project_id', 'client_id', 'hours', 'title', 'notes', 'recurring', 'deleted')
+
+ENTITY_KINDS = ('projects', 'clients', 'recurring_tasks')
+
+
+class SQLiteStorage:
+    def __init__(self, path, db_path=None, change_log_size=10000):
+        self.path = path
+        self.db_path = db_path or os.path.join(self.path, 'tasklord.db')
+        self.logos_path = os.path.join(self.path, 'logos')
+        self.change_log_size = change_log_size
+
+        # One connection per thread, all closed together
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        # Entity lists, reloaded when their version row changes
+        self._entity_versions = {}
+        self.projects = []
+        self.clients = []
+        self.recurring_tasks = []
+        self._projects_by_id = {}
+        self._clients_by_id = {}
+        self._client_projects = {}
+        self._recurring_by_id = {}
+        self.entity_loads = 0
+        # Entities are loaded on first use; the time it took, like Storage.startup_phases
+        self.startup_phases = {}
+
+        # Transactions, rows read and recurring occurrences generated, for /metrics
+        self.io_counts = Counter()
+
+        # Client id -> logo filename, rebuilt when the logos directory changes
+        self._client_logos = {}
+        self._logos_signature = None
+
+        os.makedirs(self.logos_path, exist_ok=True)
+
+        self._connection().executescript(SCHEMA)
+        with self._write() as conn:
+            # Part of every version tag, so a rebuilt database never repeats an old tag
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('database_id', ?)", (uuid.uuid4().hex,))
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('changes_since', '0')")
+            self._database_id = conn.execute("SELECT value FROM meta WHERE key = 'database_id'").fetchone()[0]
+
+    def _connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Run statements in a write transaction, taking the database write lock up front."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            # Entities may have been reloaded from the rolled back changes
+            with self._lock:
+                self._entity_versions = {}
+            raise
+        conn.execute('COMMIT')
+        self._count(write_transactions=1)
+
+    @contextmanager
+    def _read(self):
+        """Run statements against one consistent snapshot."""
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def close(self):
+        """Close every connection."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def _count(self, **amounts):
+        """Add to the I/O counters. Caller must not hold self._lock."""
+        with self._lock:
+            self.io_counts.update(amounts)
+
+    def io_stats(self):
+        """Get the I/O counters."""
+        with self._lock:
+            return dict(self.io_counts)
+
+    def cache_stats(self):
+        """Get cache statistics."""
+        return {"backend": "sqlite", "entity_loads": self.entity_loads}
+
+    # Entities
+
+    def _refresh_entities(self, conn):
+        """Reload entity lists whose version changed since we loaded them."""
+        versions = dict(conn.execute(
+            "SELECT key, seq FROM versions WHERE key IN ('projects', 'clients', 'recurring_tasks')"
+        ).fetchall())
+
+        with self._lock:
+            stale = [kind for kind in ENTITY_KINDS
+                     if kind not in self._entity_versions or self._entity_versions[kind] != versions.get(kind)]
+        if not stale:
+            return
+
+        start = time.perf_counter()
+        for kind in stale:
+            if kind == 'recurring_tasks':
+                rows = conn.execute('SELECT data FROM recurring_tasks ORDER BY rowid')
+                items = [RecurringTask(**json.loads(row['data'])) for row in rows]
+            elif kind == 'projects':
+                items = [Project(**json.loads(row['data'])) for row in conn.execute('SELECT data FROM projects ORDER BY name, id')]
+            else:
+                items = [Client(**json.loads(row['data'])) for row in conn.execute('SELECT data FROM clients ORDER BY name, id')]
+
+            with self._lock:
+                self._set_entities(kind, items)
+                self._entity_versions[kind] = versions.get(kind)
+                self.entity_loads += 1
+        if not self.startup_phases:
+            self.startup_phases = {'entities': time.perf_counter() - start}
+
+    def _set_entities(self, kind, items):
+        """Replace an entity list and rebuild its indexes. Caller must hold self._lock."""
+        setattr(self, kind, items)
+
+        if kind == 'recurring_tasks':
+            self._recurring_by_id = {t.id: t for t in items}
+        elif kind == 'projects':
+            self._projects_by_id = {p.id: p for p in items}
+            client_projects = {}
+            for project in items:
+                client_projects.setdefault(project.client_id, []).append(project)
+            self._client_projects = client_projects
+        else:
+            self._clients_by_id = {c.id: c for c in items}
+
+    def _put_entity(self, conn, kind, item):
+        """Insert or replace an entity row, keeping its position."""
+        data = json.dumps(item, default=lambda x: x.to_dict())
+        if kind == 'recurring_tasks':
+            conn.execute('INSERT INTO recurring_tasks (id, data) VALUES (?, ?) '
+                         'ON CONFLICT (id) DO UPDATE SET data = excluded.data', (item.id, data))
+        elif kind == 'projects':
+            conn.execute('INSERT INTO projects (id, name, client_id, data) VALUES (?, ?, ?, ?) '
+                         'ON CONFLICT (id) DO UPDATE SET name = excluded.name, client_id = excluded.client_id, '
+                         'data = excluded.data', (item.id, item.name, item.client_id, data))
+        else:
+            conn.execute('INSERT INTO clients (id, name, data) VALUES (?, ?, ?) '
+                         'ON CONFLICT (id) DO UPDATE SET name = excluded.name, data = excluded.data',
+                         (item.id, item.name, data))
+
+    def _get_project(self, project_id):
+        """Get a specific project by ID."""
+        return self._projects_by_id.get(project_id)
+
+    # Change log and versions
+
+    def _log_changes(self, conn, changes):
+        """Number some changes and bump the versions of what they touched."""
+        for change in changes:
+            seq = conn.execute(
+                'INSERT INTO changes (kind, item_id, month, from_date) VALUES (?, ?, ?, ?)',
+                (change['kind'], change['id'], change.get('month'), change.get('from'))
+            ).lastrowid
+            key = f"tasks:{change['month']}" if change['kind'] == 'tasks' else change['kind']
+            conn.execute('INSERT INTO versions (key, seq) VALUES (?, ?) '
+                         'ON CONFLICT (key) DO UPDATE SET seq = excluded.seq', (key, seq))
+
+        since = int(conn.execute("SELECT value FROM meta WHERE key = 'changes_since'").fetchone()[0])
+        if changes and seq - since > 2 * self.change_log_size:
+            # Forget the oldest changes; clients that far behind start over
+            since = seq - self.change_log_size
+            conn.execute('DELETE FROM changes WHERE seq <= ?', (since,))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'changes_since'", (str(since),))
+
+    def _version(self, *keys):
+        with self._read() as conn:
+            rows = dict(conn.execute(
+                f"SELECT key, seq FROM versions WHERE key IN ({', '.join('?' * len(keys))})", keys
+            ).fetchall())
+        state = (self._database_id,) + tuple(rows.get(key) for key in keys)
+        return hashlib.sha1(repr(state).encode()).hexdigest()[:20]
+
+    def month_version(self, year, month):
+        """Get a tag that changes whenever a month's tasks or summary may have changed."""
+        return self._version(f'tasks:{year}-{month:02d}', 'recurring_tasks', 'projects')
+
+    def projects_version(self):
+        """Get a tag that changes whenever the projects change."""
+        return self._version('projects')
+
+    def clients_version(self):
+        """Get a tag that changes whenever the clients change."""
+        return self._version('clients')
+
+    def change_seq(self):
+        """Get the sequence number of the latest change."""
+        with self._read() as conn:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+    def changes_since(self, seq):
+        """Get the tasks, projects, clients and recurring tasks changed after a sequence number.
+
+        Same shape as Storage.changes_since.
+        """
+        with self._read() as conn:
+            self._refresh_entities(conn)
+            current = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+            since = int(conn.execute("SELECT value FROM meta WHERE key = 'changes_since'").fetchone()[0])
+
+            result = {'seq': current, 'reset': seq < since or seq > current}
+            if result['reset']:
+                return result
+
+            latest = {}
+            for row in conn.execute('SELECT kind, item_id, from_date FROM changes WHERE seq > ? ORDER BY seq', (seq,)):
+                latest[row['kind'], row['item_id']] = row['from_date']
+
+            by_id = {
+                'projects': self._projects_by_id,
+                'clients': self._clients_by_id,
+                'recurring_tasks': self._recurring_by_id
+            }
+            for kind in ('tasks', *by_id):
+                result[kind] = {'updated': [], 'deleted': []}
+
+            changed_from = None
+            for (kind, item_id), from_date in latest.items():
+                item = self._locate_task(conn, item_id) if kind == 'tasks' else by_id[kind].get(item_id)
+                if item is None:
+                    result[kind]['deleted'].append(item_id)
+                else:
+                    result[kind]['updated'].append(item)
+                if from_date and (changed_from is None or from_date < changed_from):
+                    changed_from = from_date
+            result['recurring_changed_from'] = changed_from
+            return result
+
+    # Tasks
+
+    def load_month(self, year, month):
+        """Load all tasks for a given month."""
+        with self._read() as conn:
+            self._refresh_entities(conn)
+            tasks = self._tasks_between(conn, *month_range(year, month))
+        return {'tasks': tasks, 'summary': self._compute_summary(tasks)}
+
+    def stored_months(self):
+        """List (year, month) of every month holding saved tasks, in chronological order."""
+        with self._read() as conn:
+            rows = conn.execute('SELECT DISTINCT substr(date, 1, 7) FROM tasks ORDER BY 1').fetchall()
+        return [tuple(map(int, row[0].split('-'))) for row in rows]
+
+    def _tasks_between(self, conn, start, end):
+        """Get the tasks and recurring occurrences between two dates (inclusive)."""
+        tasks = []
+        stored = set()
+        rows = conn.execute('SELECT * FROM tasks WHERE date BETWEEN ? AND ? ORDER BY date, rowid',
+                            (start.isoformat(), end.isoformat()))
+        for row in rows:
+            stored.add(row['id'])
+            task = self._stored_task(row)
+            if task:
+                tasks.append(task)
+        count = len(tasks)
+
+        for series in self.recurring_tasks:
+            if not series.active_between(start.isoformat(), end.isoformat()):
+                continue
+            for day in series.occurrences(start, end):
+                if f"{series.id}_{day.isoformat()}" not in stored:
+                    tasks.append(self._recurring_instance(series, day))
+
+        self._count(task_rows_read=len(stored), recurring_occurrences=len(tasks) - count)
+
+        return sorted(tasks, key=lambda x: x.date)
+
+    def _stored_task(self, row):
+        """Turn a task row into a task, following its series if it is attached to one; None if the series dropped it.
+
+        Like a month file, an attached row only follows series changes made after it
+        was written and dated on or before it.
+        """
+        task = Task(**{name: row[name] for name in TASK_COLUMNS})
+        task.deleted = bool(task.deleted)
+
+        series = self._recurring_by_id.get(row['series_id']) if row['series_id'] else None
+        if series is None:
+            return task
+        since = series.changed_since(row['series_revision'])
+        if since is None or since > task.date:
+            return task
+        if task.id == series.id:
+            alive = not series.deleted
+        else:
+            alive = any(series.occurrences(parse_date(task.date), parse_date(task.date)))
+        return replace(task, **series.fields_on(task.date)) if alive else None
+
+    def _recurring_instance(self, series, day):
+        """Create the occurrence of a recurring series on a given day."""
+        day_str = day.isoformat()
+        return Task(
+            id=f"{series.id}_{day_str}",
+            date=day_str,
+            recurring=series.recurring,
+            **series.fields_on(day_str)
+        )
+
+    def _locate_task(self, conn, task_id):
+        """Get a stored task or a generated occurrence by id, None if there is no such task."""
+        row = conn.execute('SELECT * FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        if row:
+            return self._stored_task(row)
+
+        series_id, _, day = task_id.rpartition('_')
+        series = self._recurring_by_id.get(series_id)
+        if series is None:
+            return None
+        try:
+            day = parse_date(day)
+        except ValueError:
+            return None
+        return self._recurring_instance(series, day) if any(series.occurrences(day, day)) else None
+
+    def _put_task(self, conn, task, attach=True):
+        """Insert or replace a task row, attached to its series while it is recurring unless attach is False."""
+        series_id = task.id.split('_')[0]
+        if not attach or not task.recurring or series_id not in self._recurring_by_id:
+            series_id = None
+        columns = TASK_COLUMNS + ('series_id', 'series_revision')
+        conn.execute(
+            f"INSERT OR REPLACE INTO tasks ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            (task.id, task.date, task.project_id, task.client_id, task.hours, task.title, task.notes,
+             task.recurring, int(bool(task.deleted)), series_id, self._recurring_by_id[series_id].revision if series_id else None)
+        )
+
+    def _change_recurring_task(self, conn, series, change):
+        """Apply a change to a copy of a series and save it."""
+        changed = series.copy()
+        change(changed)
+        self._put_entity(conn, 'recurring_tasks', changed)
+        self._log_changes(conn, [{'kind': 'recurring_tasks', 'id': changed.id, 'from': changed.changed_since(series.revision)}])
+
+    def save_task(self, task):
+        """Save a new task to the storage."""
+        with self._write() as conn:
+            self._save_task(conn, task)
+
+    def _save_task(self, conn, task):
+        """Caller must be in a write transaction."""
+        self._refresh_entities(conn)
+        if task.recurring:
+            series = RecurringTask.start(task)
+            self._put_entity(conn, 'recurring_tasks', series)
+            self._log_changes(conn, [{'kind': 'recurring_tasks', 'id': series.id, 'from': series.date}])
+            # Picks up the new series, so the task is stored as its base
+            self._refresh_entities(conn)
+        self._put_task(conn, task)
+        self._log_changes(conn, [{'kind': 'tasks', 'id': task.id, 'month': task.date[:7]}])
+        return True
+
+    def update_task(self, task):
+        """Update an existing task in the storage."""
+        with self._write() as conn:
+            self._update_task(conn, task)
+
+    def _update_task(self, conn, task):
+        """Caller must be in a write transaction; returns False if there is no such task."""
+        self._refresh_entities(conn)
+        current = self._locate_task(conn, task.id)
+        if current is None:
+            return False
+
+        series = self._recurring_by_id.get(task.id.split('_')[0])
+        if series and current.recurring and task.recurring:
+            # Edit the series from this occurrence on
+            from_date = max(series.date, task.date)
+            self._change_recurring_task(conn, series, lambda changed: changed.edit(task, from_date))
+            return True
+
+        # A single occurrence edited without recurring is detached from its series
+        updated = replace(current)
+        updated.update(task)
+        self._put_task(conn, updated)
+        self._log_changes(conn, [{'kind': 'tasks', 'id': updated.id, 'month': updated.date[:7]}])
+        return True
+
+    def delete_task(self, task_id):
+        """Delete a task from the storage."""
+        with self._write() as conn:
+            self._delete_task(conn, task_id)
+
+    def _delete_task(self, conn, task_id):
+        """Caller must be in a write transaction; returns False if there is no such task."""
+        self._refresh_entities(conn)
+        task = self._locate_task(conn, task_id)
+        if task is None:
+            return False
+
+        series = self._recurring_by_id.get(task_id.split('_')[0])
+        if series and task.recurring:
+            # Deleting an occurrence ends the series there
+            self._change_recurring_task(conn, series, lambda changed: changed.end(task.date))
+            return True
+
+        conn.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+        self._log_changes(conn, [{'kind': 'tasks', 'id': task_id, 'month': task.date[:7]}])
+
+        # Remember a deleted detached occurrence so it is not generated again
+        if series and task_id != series.id:
+            self._change_recurring_task(conn, series, lambda changed: changed.skip(task.date))
+        return True
+
+    def apply_batch(self, operations):
+        """Apply many task creates, updates and deletes in one transaction.
+
+        Same arguments and results as Storage.apply_batch.
+        """
+        apply = {'create': self._save_task, 'update': self._update_task, 'delete': self._delete_task}
+        results = []
+        with self._write() as conn:
+            for op, task in operations:
+                result = {'id': task if op == 'delete' else task.id}
+                try:
+                    # Changes are checked before anything is written, so a refused one leaves nothing behind
+                    result['status'] = 'ok' if apply[op](conn, task) else 'not_found'
+                except ValueError as e:
+                    result.update(status='error', message=str(e))
+                results.append(result)
+        return results
+
+    def summarize(self, start, end, group_by='client'):
+        """Total the hours and amounts between two dates (inclusive).
+
+        Same shape as Storage.summarize, from a single range query.
+        """
+        start, end = parse_date(start), parse_date(end)
+        with self._read() as conn:
+            self._refresh_entities(conn)
+            tasks = self._tasks_between(conn, start, end)
+
+        groups = {}
+        amounts = price_rows((self._get_project(t.project_id), t.date, t.hours) for t in tasks)
+        for task, amount in zip(tasks, amounts):
+            if group_by == 'client':
+                key = task.client_id
+            elif group_by == 'project':
+                key = task.project_id
+            else:
+                key = task.date[:7]
+            if key not in groups:
+                groups[key] = self._summary_group(group_by, key, task.client_id)
+            groups[key]['total_hours'] += task.hours
+            groups[key]['total_amount'] += amount
+
+        groups = sorted(groups.values(), key=lambda g: g.get('month') or g.get('name') or '')
+        return {
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'group_by': group_by,
+            'groups': groups,
+            'total_hours': sum(g['total_hours'] for g in groups),
+            'total_amount': sum(g['total_amount'] for g in groups)
+        }
+
+    def export_rows(self, start, end, client_id=None, project_id=None):
+        """Yield (task, rate) for the tasks between two dates (inclusive), in date order.
+
+        Read a month at a time, each in its own short read transaction.
+        """
+        start, end = parse_date(start), parse_date(end)
+        for year, month in months_between(start, end):
+            first, last = month_range(year, month)
+            with self._read() as conn:
+                self._refresh_entities(conn)
+                tasks = [
+                    t for t in self._tasks_between(conn, max(first, start), min(last, end))
+                    if (client_id is None or t.client_id == client_id)
+                    and (project_id is None or t.project_id == project_id)
+                ]
+
+            for task in tasks:
+                project = self._get_project(task.project_id)
+                yield task, project.get_rate_for_date(task.date) if project else None
+
+    def _summary_group(self, group_by, key, client_id):
+        """Create an empty group of a range summary."""
+        if group_by == 'month':
+            group = {'month': key}
+        elif group_by == 'project':
+            project = self._get_project(key)
+            group = {'project_id': key, 'client_id': client_id, 'name': project.name if project else None}
+        else:
+            client = self._clients_by_id.get(key)
+            group = {'client_id': key, 'name': client.name if client else None}
+        group.update(total_hours=0, total_amount=0)
+        return group
+
+    def _compute_summary(self, tasks):
+        """Compute the summary of a month."""
+        summary = {}
+        amounts = price_rows((self._get_project(t.project_id), t.date, t.hours) for t in tasks)
+        for task, amount in zip(tasks, amounts):
+            client = summary.setdefault(task.client_id, {"projects": {}, "total_hours": 0, "total_amount": 0})
+            project = client["projects"].setdefault(task.project_id, {"total_hours": 0, "total_amount": 0})
+            project["total_hours"] += task.hours
+            project["total_amount"] += amount
+            client["total_hours"] += task.hours
+            client["total_amount"] += amount
+        return summary
+
+    # Recurring tasks
+
+    def load_recurring_tasks(self):
+        """Load all recurring tasks."""
+        with self._read() as conn:
+            self._refresh_entities(conn)
+        return self.recurring_tasks
+
+    def expand_recurring_tasks(self, start, end):
+        """Expand all recurring tasks into their occurrences between two dates.
+
+        Args:
+            start: First date, YYYY-MM-DD
+            end: Last date (inclusive), YYYY-MM-DD
+        """
+        start, end = parse_date(start), parse_date(end)
+        recurring_tasks = self.load_recurring_tasks()
+        expanded = [
+            self._recurring_instance(series, day)
+            for series in recurring_tasks if series.active_between(start.isoformat(), end.isoformat())
+            for day in series.occurrences(start, end)
+        ]
+        self._count(recurring_occurrences=len(expanded))
+        return sorted(expanded, key=lambda x: x.date)
+
+    def collect_recurring_garbage(self, ended_before, dry_run=False):
+        """Drop deleted recurring series, and those that ended before a date.
+
+        Same arguments and report as Storage.collect_recurring_garbage, with rows
+        written and deleted in place of months: the occurrences of an ended series
+        are stored as rows detached from it, and rows the series had dropped go.
+        """
+        with self._write() as conn:
+            self._refresh_entities(conn)
+            dead = [series for series in self.recurring_tasks if series.finished_before(ended_before)]
+            kept = [series for series in self.recurring_tasks if not series.finished_before(ended_before)]
+            report = {
+                'series': len(self.recurring_tasks),
+                'deleted_series_dropped': sum(1 for series in dead if series.deleted),
+                'ended_series_dropped': sum(1 for series in dead if not series.deleted),
+                'rows_written': 0,
+                'rows_deleted': 0,
+                'bytes_before': sum(len(json.dumps(series, default=lambda x: x.to_dict())) for series in self.recurring_tasks),
+                'bytes_after': sum(len(json.dumps(series, default=lambda x: x.to_dict())) for series in kept)
+            }
+            if dry_run or not dead:
+                return report
+
+            for series in dead:
+                # Rows as the series shows them, no longer following it
+                for row in conn.execute('SELECT * FROM tasks WHERE series_id = ?', (series.id,)).fetchall():
+                    task = self._stored_task(row)
+                    if task is None:
+                        conn.execute('DELETE FROM tasks WHERE id = ?', (row['id'],))
+                        report['rows_deleted'] += 1
+                    else:
+                        self._put_task(conn, task, attach=False)
+                        report['rows_written'] += 1
+
+                if not series.deleted:
+                    stored = {row[0] for row in conn.execute('SELECT id FROM tasks WHERE date BETWEEN ? AND ?',
+                                                             (series.date, series.until))}
+                    for day in series.occurrences(parse_date(series.date), parse_date(series.until)):
+                        task = self._recurring_instance(series, day)
+                        if task.id not in stored:
+                            self._put_task(conn, task, attach=False)
+                            report['rows_written'] += 1
+
+                conn.execute('DELETE FROM recurring_tasks WHERE id = ?', (series.id,))
+
+            # The task each series started from is reported on its own, as it outlives an ended series
+            self._log_changes(conn, [{'kind': 'recurring_tasks', 'id': series.id} for series in dead]
+                              + [{'kind': 'tasks', 'id': series.id, 'month': series.date[:7]} for series in dead])
+        return report
+
+    # Projects
+
+    def load_projects(self):
+        """Load all projects."""
+        with self._read() as conn:
+            self._refresh_entities(conn)
+        return self.projects
+
+    def save_project(self, project):
+        """Save a new project to the storage."""
+        with self._write() as conn:
+            self._put_entity(conn, 'projects', project)
+            self._log_changes(conn, [{'kind': 'projects', 'id': project.id}])
+
+    def update_project(self, project):
+        """Update an existing project in the storage."""
+        with self._write() as conn:
+            self._refresh_entities(conn)
+            old = self._projects_by_id.get(project.id)
+            if old is None:
+                return
+
+            updated = replace(old)
+            updated.update(project)
+            self._put_entity(conn, 'projects', updated)
+            self._log_changes(conn, [{'kind': 'projects', 'id': project.id}])
+
+    def delete_project(self, project_id):
+        """Delete a project from the storage."""
+        with self._write() as conn:
+            if conn.execute('DELETE FROM projects WHERE id = ?', (project_id,)).rowcount:
+                self._log_changes(conn, [{'kind': 'projects', 'id': project_id}])
+
+    def get_client_projects(self, client_id):
+        """Get all projects for a specific client."""
+        with self._read() as conn:
+            self._refresh_entities(conn)
+        return list(self._client_projects.get(client_id, []))
+
+    # Clients
+
+    def load_clients(self):
+        """Load all clients."""
+        with self._read() as conn:
+            self._refresh_entities(conn)
+        return self.clients
+
+    def save_client(self, client):
+        """Save a new client to the storage."""
+        with self._write() as conn:
+            self._put_entity(conn, 'clients', client)
+            self._log_changes(conn, [{'kind': 'clients', 'id': client.id}])
+
+    def update_client(self, client):
+        """Update an existing client in the storage."""
+        with self._write() as conn:
+            self._refresh_entities(conn)
+            old = self._clients_by_id.get(client.id)
+            if old is None:
+                return
+
+            updated = replace(old)
+            updated.update(client)
+            self._put_entity(conn, 'clients', updated)
+            self._log_changes(conn, [{'kind': 'clients', 'id': client.id}])
+
+    def save_client_logo(self, client_id, file):
+        """Save a client logo file under a name derived from its content and return the path."""
+        if not file:
+            return None
+
+        content = file.read()
+        filename = logo_filename(client_id, content, file.filename)
+        file_path = os.path.join(self.logos_path, filename)
+
+        with self._lock:
+            # Remove old logo if it exists
+            old_logo = self._get_client_logo(client_id)
+            if old_logo and os.path.exists(old_logo):
+                os.remove(old_logo)
+            self._client_logos.pop(client_id, None)
+
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            self._client_logos[client_id] = filename
+        return f"/api/logos/{filename}"
+
+    def _get_client_logo(self, client_id):
+        """Get the logo path for a client. Caller must hold self._lock."""
+        try:
+            signature = os.stat(self.logos_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        # Adding or removing a logo changes the directory mtime
+        if signature != self._logos_signature:
+            self._client_logos = {filename.split('_', 1)[0]: filename for filename in os.listdir(self.logos_path)}
+            self._logos_signature = signature
+
+        filename = self._client_logos.get(client_id)
+        return os.path.join(self.logos_path, filename) if filename else None
+
+    def delete_client(self, client_id):
+        """Delete a client and their logo from storage."""
+        with self._lock:
+            logo_path = self._get_client_logo(client_id)
+            if logo_path and os.path.exists(logo_path):
+                os.remove(logo_path)
+            self._client_logos.pop(client_id, None)
+
+        with self._write() as conn:
+            if conn.execute('DELETE FROM clients WHERE id = ?', (client_id,)).rowcount:
+                self._log_changes(conn, [{'kind': 'clients', 'id': client_id}])
+
+    # Migration
+
+    def import_storage(self, source):
+        """Copy everything from a JSON Storage into this empty database.
+
+        Occurrences the series would generate anyway are not stored; occurrences
+        missing from a saved month become skipped dates, as that is how the month
+        left them.
+        """
+        with self._write() as conn:
+            if conn.execute('SELECT EXISTS (SELECT 1 FROM tasks UNION ALL SELECT 1 FROM projects '
+                            'UNION ALL SELECT 1 FROM clients)').fetchone()[0]:
+                raise ValueError(f'{self.db_path} already holds data')
+
+            for client in source.load_clients():
+                self._put_entity(conn, 'clients', client)
+            for project in source.load_projects():
+                self._put_entity(conn, 'projects', project)
+
+            series_by_id = {series.id: series.copy() for series in source.load_recurring_tasks()}
+            with self._lock:
+                self._recurring_by_id = series_by_id
+
+            stored = []
+            for year, month in source._saved_months():
+                tasks = source.load_month(year, month)['tasks']
+                present = {task.id for task in tasks}
+
+                for task in tasks:
+                    series = series_by_id.get(task.id.split('_')[0])
+                    generated = (
+                        series is not None and task.recurring and task.id != series.id
+                        and self._stored_task_matches(series, task)
+                    )
+                    if not generated:
+                        stored.append(task)
+
+                for series in series_by_id.values():
+                    for day in series.occurrences(*month_range(year, month)):
+                        if f"{series.id}_{day.isoformat()}" not in present:
+                            series.skip(day.isoformat())
+
+            for series in series_by_id.values():
+                self._put_entity(conn, 'recurring_tasks', series)
+            # Written once the skips are in, so rows start from the final revision
+            for task in stored:
+                self._put_task(conn, task)
+
+            # Start every version from a known state
+            stamp = datetime.now().isoformat()
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_at', ?)", (stamp,))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'database_id'", (uuid.uuid4().hex,))
+        self._entity_versions = {}
+        return len(stored)
+
+    def _stored_task_matches(self, series, task):
+        """Check whether an occurrence is exactly what its series generates."""
+        day = parse_date(task.date)
+        if not any(series.occurrences(day, day)):
+            return False
+        return self._recurring_instance(series, day) == task
@@ -0,0 +1,150 @@
+"""In-memory static file server for the React build.
+
+The build is read once into memory, with gzip (and brotli, if the brotli
+package is installed) variants compressed up front, so requests never touch
+the disk. Hashed files under static/ are cached by browsers forever; the rest,
+index.html included, are revalidated against their ETag. The build is indexed
+on the first request, then checked for changes every few seconds and indexed
+again when it was rebuilt.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'application/manifest+json', 'image/svg+xml')
+
+# Smaller files gain nothing from compression
+MIN_COMPRESS_SIZE = 1024
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    __slots__ = ('mimetype', 'etag', 'variants')
+
+    def __init__(self, mimetype, etag, variants):
+        self.mimetype = mimetype
+        self.etag = etag
+        # Content-Encoding (None for identity) -> bytes
+        self.variants = variants
+
+
+class StaticAssets:
+    def __init__(self, root, check_interval=2):
+        self.root = root
+        self.check_interval = check_interval
+        self._assets = {}
+        self._signature = None
+        self._checked_at = 0
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+
+    def _build_signature(self):
+        """Change markers of the build: its directory and index.html (rewritten by every build)."""
+        signature = []
+        for path in (self.root, os.path.join(self.root, 'index.html')):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _reload(self):
+        """Index every file of the build. Caller must hold the reload lock."""
+        signature = self._build_signature()
+        assets = {}
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                # Precompressed files shipped with the build are used as variants of their original
+                if name.endswith(('.gz', '.br')) and os.path.exists(path[:-3]):
+                    continue
+                assets[name] = self._load(path, name)
+
+        self._assets = assets
+        self._signature = signature
+        self.reloads += 1
+
+    def _load(self, path, name):
+        with open(path, 'rb') as f:
+            content = f.read()
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        variants = {None: content}
+
+        if mimetype.startswith(COMPRESSIBLE) and len(content) >= MIN_COMPRESS_SIZE:
+            for encoding, suffix, compress in (
+                ('gzip', '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+                ('br', '.br', brotli.compress if brotli else None)
+            ):
+                if os.path.exists(path + suffix):
+                    with open(path + suffix, 'rb') as f:
+                        variants[encoding] = f.read()
+                elif compress:
+                    compressed = compress(content)
+                    if len(compressed) < len(content):
+                        variants[encoding] = compressed
+
+        return Asset(mimetype, hashlib.sha1(content).hexdigest()[:20], variants)
+
+    def _check_for_changes(self):
+        """Re-index the build if it changed, checking at most every check_interval seconds."""
+        now = time.monotonic()
+        indexed = self._signature is not None
+        if indexed and now - self._checked_at < self.check_interval:
+            return
+        # The first requests wait for the build to be indexed; later, one thread
+        # re-indexes while the others keep serving the previous build
+        if not self._reload_lock.acquire(blocking=not indexed):
+            return
+        try:
+            if self._signature is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            if self._build_signature() != self._signature:
+                self._reload()
+        finally:
+            self._reload_lock.release()
+
+    def exists(self, name):
+        self._check_for_changes()
+        return name in self._assets
+
+    def response(self, name):
+        """Build the response for a file of the build, None if there is no such file."""
+        self._check_for_changes()
+        asset = self._assets.get(name)
+        if asset is None:
+            return None
+
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and candidate in request.accept_encodings:
+                encoding = candidate
+                break
+        # Every encoding is a different representation, with its own tag
+        etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        if len(asset.variants) > 1:
+            response.headers['Vary'] = 'Accept-Encoding'
+        # Files under static/ carry a content hash in their name, so a new build never reuses one
+        response.headers['Cache-Control'] = IMMUTABLE if name.startswith('static/') else 'no-cache'
+        return response
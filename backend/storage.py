@@ -1,369 +1,1785 @@
-from datetime import datetime, timedelta
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import fields, replace
+from datetime import datetime
+import hashlib
 import json
+import logging
 import os
+import pickle
 import shutil
-from werkzeug.utils import secure_filename
+import tempfile
+import threading
+import time
+import uuid
 
-from models import Task, Project, Client
+from logos import logo_filename
+from models import Task, Project, Client, RecurringTask, price_rows
+from recurrence import month_range, months_between, parse_date
 
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking is available
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+startup_logger = logging.getLogger('tasklord.startup')
+
+# Bumped whenever the layout of the entity snapshot changes
+SNAPSHOT_FORMAT = 1
+
+# Months share this many locks (and lock files), so their number stays fixed however many months are asked for
+MONTH_LOCK_STRIPES = 64
+
+
+class StorageLock:
+    """Re-entrant lock shared by threads and, where supported, processes."""
 
-class Storage:
     def __init__(self, path):
         self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._file:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+class Storage:
+    def __init__(self, path, month_cache_size=24, verify_summaries=False, pretty_json=False,
+                 journal=True, journal_compact_interval=30, journal_max_records=1000, change_log_size=10000,
+                 entity_snapshot=False, rollup_cache_size=240):
+        self.path = path
         self.project_path = os.path.join(self.path, 'projects.json')
         self.clients_path = os.path.join(self.path, 'clients.json')
         self.recurring_path = os.path.join(self.path, 'recurring.json')
+        self.months_path = os.path.join(self.path, 'months')
         self.logos_path = os.path.join(self.path, 'logos')
-
-        self.date = None
-        self.data = {}
-
-        self.recurring_tasks = None
-        self.projects = None
-        self.clients = None
-
-        os.makedirs(os.path.join(self.path, 'months'), exist_ok=True)
+        self.locks_path = os.path.join(self.path, 'locks')
+        self.journal_path = os.path.join(self.path, 'journal.jsonl')
+        self.changes_path = os.path.join(self.path, 'changes.jsonl')
+        self.snapshot_path = os.path.join(self.path, 'entities.snapshot')
+
+        # Guards the in-memory caches below; never held while waiting on a StorageLock
+        self._lock = threading.Lock()
+
+        # Parsed months keyed by (year, month) -> (file signature, data), in LRU order
+        self.month_cache_size = month_cache_size
+        self._month_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # Files read and written, bytes moved and recurring occurrences generated, for /metrics
+        self.io_counts = Counter()
+
+        # Task id -> (year, month) for every task seen in a month file
+        self._task_months = {}
+
+        # Cached months whose summary matches their tasks and the current rates,
+        # so it can be patched with deltas instead of recomputed
+        self._trusted_summaries = set()
+        self.verify_summaries = verify_summaries
+
+        # Path -> (file signature, content digest) of our last write, to skip rewriting identical content
+        self.pretty_json = pretty_json
+        self._written = {}
+
+        # Lock order: entities first, then months in any order one at a time
+        self._entities_lock = StorageLock(os.path.join(self.locks_path, 'entities.lock'))
+        # Stripe -> lock; months are never locked two at a time, so sharing a stripe cannot deadlock
+        self._month_locks = {}
+        self._entity_signatures = {}
+
+        self.recurring_tasks = []
+        self.projects = []
+        self.clients = []
+
+        # Id indexes over the ordered entity lists, rebuilt whenever a list is replaced
+        self._recurring_by_id = {}
+        self._projects_by_id = {}
+        self._clients_by_id = {}
+        self._client_projects = {}
+
+        # Client id -> logo filename, rebuilt when the logos directory changes
+        self._client_logos = {}
+        self._logos_signature = None
+
+        # (year, month) -> {task id: position in the month's task list}, repaired on a miss
+        self._month_indexes = {}
+
+        # (year, month) -> (month version, summary) for range summaries, least recently used first
+        self._rollups = OrderedDict()
+        self.rollup_cache_size = rollup_cache_size
+        self.rollup_hits = 0
+        self.rollup_misses = 0
+
+        # Append-only log of changes not yet folded into the month and entity files.
+        # The first line names the journal generation, a new one starts at every compaction.
+        self.journal = journal
+        self.journal_compact_interval = journal_compact_interval
+        self.journal_max_records = journal_max_records
+        self._journal_generation = None
+        self._journal_signature = None
+        self._journal_offset = 0
+        self._journal_seq = 0
+        self._journal_records = 0
+        # Journal records per month and entity list, replayed over their files when read
+        self._journal_months = {}
+        self._journal_entities = {}
+        # (year, month) or entity attribute -> sequence number of its last journal record
+        self._journal_versions = {}
+        # Saved months patched after a series change, written out at the next compaction
+        self._patched_months = set()
+        self._compaction_wanted = threading.Event()
+        self._closed = False
+
+        # Ids of changed tasks and entities in sequence order, for clients syncing deltas.
+        # The first line of the log holds the sequence number it starts after.
+        self.change_log_size = change_log_size
+        self._changes = []
+        self._changes_since = None
+        self._changes_signature = None
+        self._changes_offset = 0
+        self._change_seq = 0
+
+        self._entity_files = {
+            'projects': (self.project_path, Project),
+            'clients': (self.clients_path, Client),
+            'recurring_tasks': (self.recurring_path, RecurringTask)
+        }
+
+        # Pickled entity lists with the signatures of the files they were read from,
+        # loaded instead of parsing the JSON again while the files are unchanged
+        self.entity_snapshot = entity_snapshot
+        self._snapshot = None
+        self._snapshot_signatures = None
+
+        # Entities are loaded and the last run's journal folded in on first use, not here,
+        # so the server can start answering sooner; the time it takes is kept by phase
+        self._started = False
+        self.startup_phases = {}
+
+        os.makedirs(self.months_path, exist_ok=True)
         os.makedirs(self.logos_path, exist_ok=True)
-
-        self.load_projects()
-        self.load_clients()
-        self.load_recurring_tasks()
-
-    @property
-    def month_path(self):
-        return os.path.join(self.path, 'months', f'{self.date.year}_{self.date.month}.json')
+        os.makedirs(self.locks_path, exist_ok=True)
+
+        if self.journal:
+            threading.Thread(target=self._compact_periodically, name='journal-compaction', daemon=True).start()
+
+    def close(self):
+        """Stop background compaction and fold the journal into the files."""
+        self._closed = True
+        self._compaction_wanted.set()
+        if self._started:
+            self.compact_journal()
+
+    def _start(self):
+        """Load the entities and fold in whatever the last run left in the journal. Caller must hold the entities lock."""
+        self._started = True
+        try:
+            start = time.perf_counter()
+            self._refresh_entities()
+            loaded = time.perf_counter()
+            try:
+                self.compact_journal()
+            except Exception:
+                # Months still get the journal's changes when read; the next compaction tries again
+                logger.exception("Could not fold the journal into the data files")
+        except BaseException:
+            self._started = False
+            raise
+
+        self.startup_phases = {'entities': loaded - start, 'journal': time.perf_counter() - loaded}
+        startup_logger.info("Storage %s loaded on first use: %s", self.path,
+                            ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in self.startup_phases.items()))
+
+    # Months
+
+    def _month_path(self, year, month):
+        return os.path.join(self.months_path, f'{year}_{month}.json')
+
+    def _month_lock(self, year, month):
+        """Get the lock guarding a month file, shared with the months of the same stripe."""
+        if not 1 <= month <= 12:
+            raise ValueError(f"month must be 1 to 12, not {month}")
+        stripe = (year * 12 + month - 1) % MONTH_LOCK_STRIPES
+        with self._lock:
+            lock = self._month_locks.get(stripe)
+            if lock is None:
+                lock = StorageLock(os.path.join(self.locks_path, f'months_{stripe}.lock'))
+                self._month_locks[stripe] = lock
+            return lock
 
     def load_month(self, year, month):
         """Load all tasks for a given month."""
-        self.date = datetime(year, month, 1)
-        if not os.path.exists(self.month_path):
-            self.data = {'tasks': [], 'summary': {}}
-            self._apply_recurring_tasks()
-            self._update_summary()
+        self._refresh_entities()
+        with self._month_lock(year, month):
+            data = self._read_month(year, month)
+            return {'tasks': list(data['tasks']), 'summary': data['summary']}
+
+    @contextmanager
+    def _open_month(self, year, month):
+        """Lock a month for writing, yield its data and write it back afterwards."""
+        with self._month_lock(year, month):
+            data = self._read_month(year, month)
+            before = {task.id: task for task in data['tasks']}
+            try:
+                yield data
+            except BaseException:
+                # Drop whatever the caller half-applied to the cached copy
+                with self._lock:
+                    self._month_cache.pop((year, month), None)
+                    self._trusted_summaries.discard((year, month))
+                raise
+
+            # Tasks are replaced, never modified in place, so identity tells what changed
+            current = {task.id for task in data['tasks']}
+            put = [task for task in data['tasks'] if before.get(task.id) is not task]
+            delete = [task_id for task_id in before if task_id not in current]
+
+            if self.journal:
+                self._journal_month(year, month, data, put, delete)
+            else:
+                self._dump_month(year, month, data)
+            self._log_changes([
+                {'kind': 'tasks', 'id': task_id, 'month': f'{year}-{month:02d}'}
+                for task_id in [task.id for task in put] + delete
+            ])
+
+    def _read_month(self, year, month):
+        """Read a month, bringing its recurring tasks up to date. Caller must hold the month lock."""
+        data = self._read_month_data(year, month)
+        self._sync_recurring_tasks(year, month, data)
+        return data
+
+    def _read_month_data(self, year, month):
+        """Read a month from the cache or disk. Caller must hold the month lock."""
+        signature = self._month_signature(year, month)
+
+        with self._lock:
+            cached = self._month_cache.get((year, month))
+            if cached and cached[0] == signature:
+                self._month_cache.move_to_end((year, month))
+                self.cache_hits += 1
+                return cached[1]
+            self.cache_misses += 1
+
+        if signature is None:
+            data = {'tasks': [], 'summary': {}, 'series': {}}
+            self._apply_recurring_tasks(data, year, month)
         else:
-            with open(self.month_path) as f:
-                data = json.load(f)
-                self.data = {'tasks': [Task(**task) for task in data['tasks']], 'summary': data.get('summary', {})}
-
-        return self.data
-
-    def _dump_month(self):
-        """Dump the data for a given month to a file."""
+            with open(self._month_path(year, month), 'rb') as f:
+                content = f.read()
+            self._count(month_reads=1, month_read_bytes=len(content))
+            month_data = json.loads(content)
+            data = {
+                'tasks': [Task(**task) for task in month_data['tasks']],
+                'summary': month_data.get('summary', {}),
+                # Revision of each recurring series the month reflects
+                'series': month_data.get('series', {})
+            }
+
+            with self._lock:
+                for task in data['tasks']:
+                    self._task_months[task.id] = (year, month)
+                # Stored summaries may predate a rate change
+                self._trusted_summaries.discard((year, month))
+
+        with self._lock:
+            pending = list(self._journal_months.get((year, month), ()))
+        for record in pending:
+            self._apply_month_record(year, month, data, record)
+        if signature is None or pending:
+            # Once, after every journaled change, rather than once per record
+            data['summary'] = self._compute_summary(data['tasks'])
+            with self._lock:
+                self._trusted_summaries.add((year, month))
+
+        self._cache_month(year, month, signature, data)
+        return data
+
+    def _dump_month(self, year, month, data):
+        """Dump the data for a given month to a file. Caller must hold the month lock."""
         # Sort the tasks by date
-        self.data['tasks'] = sorted(self.data['tasks'], key=lambda x: x.date)
-
-        with open(self.month_path, 'w') as f:
-            json.dump(self.data, f, indent=2, default=lambda x: x.__dict__)
+        data['tasks'] = sorted(data['tasks'], key=lambda x: x.date)
+
+        signature = self._write_json(self._month_path(year, month), data)
+
+        with self._lock:
+            for task in data['tasks']:
+                self._task_months[task.id] = (year, month)
+
+        self._cache_month(year, month, signature, data)
+
+    def _journal_month(self, year, month, data, put, delete):
+        """Journal the tasks that changed in a month instead of rewriting it. Caller must hold the month lock."""
+        data['tasks'] = sorted(data['tasks'], key=lambda x: x.date)
+
+        with self._lock:
+            for task in put:
+                self._task_months[task.id] = (year, month)
+
+        if put or delete:
+            self._append_journal({
+                'month': [year, month], 'put': put, 'delete': delete,
+                'series': dict(data['series'])
+            })
+        self._cache_month(year, month, self._month_signature(year, month), data)
+
+    def _apply_month_record(self, year, month, data, record):
+        """Apply a journaled month change to its tasks, leaving the summary to the caller.
+
+        Caller must hold the month lock.
+
+        Returns:
+            The tasks removed and added, for patching the summary
+        """
+        deleted = set(record['delete'])
+        put = {task.id: task for task in record['put']}
+        removed, added, tasks = [], [], []
+
+        for task in data['tasks']:
+            if task.id in deleted or task.id in put:
+                removed.append(task)
+                if task.id not in put:
+                    continue
+                task = put.pop(task.id)
+                added.append(task)
+            tasks.append(task)
+        tasks.extend(put.values())
+        added.extend(put.values())
+
+        data['tasks'] = sorted(tasks, key=lambda x: x.date)
+        # The record's occurrences may be older than the month's, so patch from the older revision on read
+        for series_id, revision in record['series'].items():
+            data['series'][series_id] = min(data['series'].get(series_id, 0), revision)
+        with self._lock:
+            for task_id in deleted:
+                self._task_months.pop(task_id, None)
+            for task in added:
+                self._task_months[task.id] = (year, month)
+        return removed, added
+
+    def _month_signature(self, year, month):
+        """Get the (mtime, size) of a month file, None if it does not exist."""
+        return _file_signature(self._month_path(year, month))
+
+    def _write_json(self, path, obj):
+        """Write JSON atomically and return the file signature.
+
+        The content goes to a temporary file that is fsynced and renamed over the
+        target, so readers and crashes only ever see a complete file. Writing the
+        same content we last wrote to an untouched file is skipped.
+        """
+        if self.pretty_json:
+            content = json.dumps(obj, indent=2, default=lambda x: x.to_dict())
+        else:
+            content = json.dumps(obj, separators=(',', ':'), default=lambda x: x.to_dict())
+        content = content.encode()
+        digest = hashlib.sha1(content).digest()
+
+        signature = _file_signature(path)
+        with self._lock:
+            if signature is not None and self._written.get(path) == (signature, digest):
+                return signature
+
+        signature = self._replace_file(path, content)
+        with self._lock:
+            self._written[path] = (signature, digest)
+        if os.path.dirname(path) == self.months_path:
+            self._count(month_writes=1, month_write_bytes=len(content))
+        return signature
+
+    def _replace_file(self, path, content):
+        """Atomically replace a file with some bytes and return its signature."""
+        directory = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _fsync_directory(directory)
+        self._count(files_written=1, bytes_written=len(content))
+        return _file_signature(path)
+
+    def _cache_month(self, year, month, signature, data):
+        """Store a month in the cache, evicting the least recently used."""
+        if self.month_cache_size <= 0:
+            return
 
-    def _update_summary(self):
-        """Update the summary of a month."""
+        with self._lock:
+            self._month_cache[(year, month)] = (signature, data)
+            self._month_cache.move_to_end((year, month))
+            while len(self._month_cache) > self.month_cache_size:
+                key, _ = self._month_cache.popitem(last=False)
+                self._trusted_summaries.discard(key)
+                self._month_indexes.pop(key, None)
+
+    def _find_task(self, year, month, data, task_id):
+        """Get the position of a task in a month's task list, None if it is not there."""
+        tasks = data['tasks']
+        with self._lock:
+            index = self._month_indexes.get((year, month), {})
+
+        i = index.get(task_id)
+        if i is None or i >= len(tasks) or tasks[i].id != task_id:
+            # The list changed since the index was built
+            index = {t.id: i for i, t in enumerate(tasks)}
+            with self._lock:
+                self._month_indexes[(year, month)] = index
+            i = index.get(task_id)
+        return i
+
+    def _invalidate_unsaved_months(self):
+        """Drop cached months that only exist as recurring expansions."""
+        with self._lock:
+            # Journaled months are patched like saved ones
+            unsaved = [k for k, (signature, _) in self._month_cache.items()
+                       if signature is None and k not in self._journal_months]
+            for key in unsaved:
+                del self._month_cache[key]
+                self._trusted_summaries.discard(key)
+
+    def _saved_months(self):
+        """List (year, month) of every month file, in chronological order."""
+        months = []
+        for filename in os.listdir(self.months_path):
+            if filename.endswith('.json'):
+                year, month = map(int, filename.replace('.json', '').split('_'))
+                months.append((year, month))
+        return sorted(months)
+
+    def stored_months(self):
+        """List (year, month) of every month holding saved tasks, in chronological order."""
+        self._refresh_entities()
+        with self._lock:
+            journaled = set(self._journal_months)
+        return sorted(set(self._saved_months()) | journaled)
+
+    def month_version(self, year, month):
+        """Get a tag that changes whenever a month's tasks or summary may have changed.
+
+        It is derived from the files and journal shared by all workers, so every
+        worker hands out the same tag for the same state without loading the month.
+        """
+        self._refresh_entities()
+        with self._lock:
+            return self._month_version(year, month)
+
+    def _month_version(self, year, month):
+        """Get a month's version from the state already loaded. Caller must hold self._lock."""
+        return _version_tag(
+            self._month_signature(year, month), self._journal_versions.get((year, month)),
+            self._entity_version('recurring_tasks'), self._entity_version('projects')
+        )
+
+    def projects_version(self):
+        """Get a tag that changes whenever the projects change."""
+        self._refresh_entities()
+        with self._lock:
+            return _version_tag(self._entity_version('projects'))
+
+    def clients_version(self):
+        """Get a tag that changes whenever the clients change."""
+        self._refresh_entities()
+        with self._lock:
+            return _version_tag(self._entity_version('clients'))
+
+    def _entity_version(self, attr):
+        return self._entity_signatures.get(attr), self._journal_versions.get(attr)
+
+    def _count(self, **amounts):
+        """Add to the I/O counters. Caller must not hold self._lock."""
+        with self._lock:
+            self.io_counts.update(amounts)
+
+    def io_stats(self):
+        """Get the I/O counters."""
+        with self._lock:
+            return dict(self.io_counts)
+
+    def cache_stats(self):
+        """Get month cache statistics."""
+        with self._lock:
+            return {
+                "size": len(self._month_cache),
+                "capacity": self.month_cache_size,
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "rollup_hits": self.rollup_hits,
+                "rollup_misses": self.rollup_misses
+            }
+
+    def _compute_summary(self, tasks):
+        """Compute the summary of a month from scratch."""
         summary = {}
-
-        for task in self.data["tasks"]:
-            project_id = task.project_id
-            client_id = task.client_id
-
-            if client_id not in summary:
-                summary[client_id] = {"projects": {}, "total_hours": 0, "total_amount": 0}
-            if project_id not in summary[client_id]["projects"]:
-                summary[client_id]["projects"][project_id] = {"total_hours": 0, "total_amount": 0}
-
+        # Date-aware rates, priced per project in one batch
+        amounts = price_rows((self._get_project(t.project_id), t.date, t.hours) for t in tasks)
+        for task, amount in zip(tasks, amounts):
+            self._add_to_summary(summary, task, amount=amount)
+        return summary
+
+    def _add_to_summary(self, summary, task, sign=1, amount=None):
+        """Add a task's hours and amount to a summary, or subtract them with sign=-1."""
+        project_id = task.project_id
+        client_id = task.client_id
+
+        if client_id not in summary:
+            summary[client_id] = {"projects": {}, "total_hours": 0, "total_amount": 0}
+        if project_id not in summary[client_id]["projects"]:
+            summary[client_id]["projects"][project_id] = {"total_hours": 0, "total_amount": 0}
+
+        if amount is None:
+            # Use date-aware rate lookup; tasks of a deleted project count for nothing, like in price_rows
             project = self._get_project(project_id)
-            hours = task.hours
-            # Use date-aware rate lookup
-            rate = project.get_rate_for_date(task.date)
-            summary[client_id]["projects"][project_id]["total_hours"] += hours
-            summary[client_id]["projects"][project_id]["total_amount"] += hours * rate
-            summary[client_id]["total_hours"] += hours
-            summary[client_id]["total_amount"] += hours * rate
+            amount = task.hours * project.get_rate_for_date(task.date) if project else 0.0
+        hours = task.hours * sign
+        amount *= sign
+        summary[client_id]["projects"][project_id]["total_hours"] += hours
+        summary[client_id]["projects"][project_id]["total_amount"] += amount
+        summary[client_id]["total_hours"] += hours
+        summary[client_id]["total_amount"] += amount
+
+    def _update_summary(self, year, month, data, removed=(), added=()):
+        """Update the summary of a month after removing and adding tasks.
+
+        Trusted summaries are patched with the changed tasks only; anything else
+        (months read from disk, after rate changes) is recomputed once in full.
+        The patch goes to a copy that then replaces the summary, since load_month
+        hands the current one out to readers.
+        """
+        if (year, month) not in self._trusted_summaries:
+            data["summary"] = self._compute_summary(data["tasks"])
+            self._trusted_summaries.add((year, month))
+            return
 
-        self.data["summary"] = summary
+        summary = _copy_summary(data["summary"])
+        for task in removed:
+            self._add_to_summary(summary, task, sign=-1)
+        for task in added:
+            self._add_to_summary(summary, task)
+
+        # Drop entries whose last task was removed, like a full recompute would
+        remaining = {(t.client_id, t.project_id) for t in data["tasks"]}
+        for task in removed:
+            client = summary.get(task.client_id)
+            if client and (task.client_id, task.project_id) not in remaining:
+                client["projects"].pop(task.project_id, None)
+                if not client["projects"]:
+                    del summary[task.client_id]
+
+        if self.verify_summaries:
+            expected = self._compute_summary(data["tasks"])
+            if not _summaries_match(summary, expected):
+                logger.warning("Incremental summary for %d-%02d drifted from a full recompute, using the recompute", year, month)
+                summary = expected
+        data["summary"] = summary
+
+    def _distrust_summaries(self):
+        """Force a full summary recompute on the next write of every month."""
+        with self._lock:
+            self._trusted_summaries.clear()
+
+    def summarize(self, start, end, group_by='client'):
+        """Total the hours and amounts between two dates (inclusive).
+
+        Months entirely inside the range come from per-month rollups, recomputed
+        only when the month's version changes; the partial months at either end
+        are summed from their tasks.
+
+        Args:
+            start: First date, YYYY-MM-DD
+            end: Last date (inclusive), YYYY-MM-DD
+            group_by: 'client', 'project' or 'month'
+        """
+        start, end = parse_date(start), parse_date(end)
+        self._refresh_entities()
+
+        groups = {}
+        for year, month in months_between(start, end):
+            if not self._may_hold_tasks(year, month):
+                continue
+            first, last = month_range(year, month)
+            with self._month_lock(year, month):
+                if start <= first and last <= end:
+                    summary = self._month_rollup(year, month)
+                else:
+                    lo, hi = max(first, start).isoformat(), min(last, end).isoformat()
+                    tasks = self._read_month(year, month)['tasks']
+                    summary = self._compute_summary([t for t in tasks if lo <= t.date <= hi])
+
+            for client_id, client in summary.items():
+                for project_id, totals in client['projects'].items():
+                    if group_by == 'client':
+                        key = client_id
+                    elif group_by == 'project':
+                        key = project_id
+                    else:
+                        key = f'{year}-{month:02d}'
+                    if key not in groups:
+                        groups[key] = self._summary_group(group_by, key, client_id)
+                    groups[key]['total_hours'] += totals['total_hours']
+                    groups[key]['total_amount'] += totals['total_amount']
+
+        groups = sorted(groups.values(), key=lambda g: g.get('month') or g.get('name') or '')
+        return {
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'group_by': group_by,
+            'groups': groups,
+            'total_hours': sum(g['total_hours'] for g in groups),
+            'total_amount': sum(g['total_amount'] for g in groups)
+        }
+
+    def export_rows(self, start, end, client_id=None, project_id=None):
+        """Yield (task, rate) for the tasks between two dates (inclusive), in date order.
+
+        Months are read one at a time and never held after their rows are yielded,
+        so memory stays flat however many years the range covers. The rate is the
+        one in effect on the task's date, None if its project no longer exists.
+        """
+        start, end = parse_date(start), parse_date(end)
+        for year, month in months_between(start, end):
+            first, last = month_range(year, month)
+            lo, hi = max(first, start).isoformat(), min(last, end).isoformat()
+
+            self._refresh_entities()
+            if not self._may_hold_tasks(year, month):
+                continue
+            with self._month_lock(year, month):
+                tasks = [
+                    t for t in self._read_month(year, month)['tasks']
+                    if lo <= t.date <= hi
+                    and (client_id is None or t.client_id == client_id)
+                    and (project_id is None or t.project_id == project_id)
+                ]
+
+            for task in sorted(tasks, key=lambda t: t.date):
+                project = self._get_project(task.project_id)
+                yield task, project.get_rate_for_date(task.date) if project else None
+
+    def _may_hold_tasks(self, year, month):
+        """Check whether a month has a file, journaled changes or recurring occurrences, without locking it.
+
+        Months with none of these are empty, so ranges pass over them without a lock or a rollup.
+        """
+        if self._month_signature(year, month) is not None:
+            return True
+        with self._lock:
+            if (year, month) in self._journal_months:
+                return True
+        start, end = (day.isoformat() for day in month_range(year, month))
+        return any(series.active_between(start, end) for series in self.recurring_tasks)
+
+    def _summary_group(self, group_by, key, client_id):
+        """Create an empty group of a range summary."""
+        if group_by == 'month':
+            group = {'month': key}
+        elif group_by == 'project':
+            project = self._get_project(key)
+            group = {'project_id': key, 'client_id': client_id, 'name': project.name if project else None}
+        else:
+            client = self._clients_by_id.get(key)
+            group = {'client_id': key, 'name': client.name if client else None}
+        group.update(total_hours=0, total_amount=0)
+        return group
+
+    def _month_rollup(self, year, month):
+        """Get a month's summary, computed at most once per month version. Caller must hold the month lock."""
+        # Taken before reading, so a concurrent change can only make the rollup look older than it is
+        with self._lock:
+            version = self._month_version(year, month)
+            cached = self._rollups.get((year, month))
+            if cached and cached[0] == version:
+                self._rollups.move_to_end((year, month))
+                self.rollup_hits += 1
+                return cached[1]
+            self.rollup_misses += 1
+
+        # A fresh summary: the month's own may predate a rate change
+        summary = self._compute_summary(self._read_month(year, month)['tasks'])
+
+        with self._lock:
+            self._rollups[(year, month)] = (version, summary)
+            self._rollups.move_to_end((year, month))
+            while len(self._rollups) > self.rollup_cache_size:
+                self._rollups.popitem(last=False)
+        return summary
 
     # Tasks
 
+    def _locate_task(self, task_id, date=None):
+        """Find the (year, month) holding a task, using its id, a date hint or a scan of the month files."""
+        # Recurring instances carry their date in the id
+        if '_' in task_id:
+            try:
+                instance_date = datetime.strptime(task_id.rpartition('_')[2], '%Y-%m-%d')
+            except ValueError:
+                # Neither an occurrence nor a plain task (those ids have no '_')
+                return None
+            return instance_date.year, instance_date.month
+
+        # Pick up tasks other processes have only journaled so far
+        self._refresh_entities()
+
+        candidates = []
+        with self._lock:
+            if task_id in self._task_months:
+                candidates.append(self._task_months[task_id])
+        if date:
+            task_date = datetime.strptime(date, '%Y-%m-%d')
+            candidates.append((task_date.year, task_date.month))
+
+        # The index may be stale if another process moved things around, so verify before trusting it
+        with self._lock:
+            candidates.extend(self._journal_months)
+        for year, month in candidates + self._saved_months():
+            with self._month_lock(year, month):
+                if self._find_task(year, month, self._read_month(year, month), task_id) is not None:
+                    return year, month
+        return None
+
     def save_task(self, task):
         """Save a new task to the storage."""
         date = datetime.strptime(task.date, '%Y-%m-%d')
-        self.load_month(date.year, date.month)
-
-        # Save the task
-        self.data['tasks'].append(task)
 
-        if task.recurring:
-            self.recurring_tasks.append(task)
-            with open(self.recurring_path, 'w') as f:
-                json.dump(self.recurring_tasks, f, indent=2, default=lambda x: x.__dict__)
+        with self._entities_lock:
+            self._refresh_entities()
+            series = RecurringTask.start(task) if task.recurring else None
 
-            self._apply_recurring_task(task)
+            with self._open_month(date.year, date.month) as data:
+                count = len(data['tasks'])
+                data['tasks'].append(task)
+                if series:
+                    self._apply_recurring_task(series, data, date.year, date.month)
+                self._update_summary(date.year, date.month, data, added=data['tasks'][count:])
 
-        self._update_summary()
-        self._dump_month()
+            # Only register the series once its month is saved, so expanding it does not add it twice
+            if series:
+                self._dump_recurring_tasks(self.recurring_tasks + [series])
 
     def update_task(self, task):
         """Update an existing task in the storage."""
-        for i, t in enumerate(self.data['tasks']):
-            if t.id == task.id:
-                was_recurring = t.recurring or task.recurring
-                t.update(task)
-
-                if was_recurring:
-                    self._update_recurring_task(task)
-
-                self.data['tasks'][i] = t
-                break
+        location = self._locate_task(task.id, task.date)
+        if location is None:
+            return
 
-        self._update_summary()
-        self._dump_month()
+        with self._entities_lock:
+            self._refresh_entities()
+
+            with self._month_lock(*location):
+                data = self._read_month(*location)
+                i = self._find_task(*location, data, task.id)
+                if i is None:
+                    return
+                current = data['tasks'][i]
+
+            series = self._recurring_by_id.get(task.id.split('_')[0])
+            if series and current.recurring and task.recurring:
+                # Edit the series from this occurrence on; the month is patched when read back
+                self._edit_recurring_task(series, task)
+                with self._month_lock(*location):
+                    self._read_month(*location)
+                return
+
+            # A single occurrence edited without recurring is detached from its series
+            with self._open_month(*location) as data:
+                i = self._find_task(*location, data, task.id)
+                current = data['tasks'][i]
+                updated = replace(current)
+                updated.update(task)
+                data['tasks'][i] = updated
+                self._update_summary(*location, data, removed=[current], added=[updated])
 
     def delete_task(self, task_id):
         """Delete a task from the storage."""
-        for task in self.data['tasks']:
-            if task.id == task_id:
-                if task.recurring:
-                    self._delete_recurring_task(task)
-                else:
-                    self.data['tasks'].remove(task)
+        location = self._locate_task(task_id)
+        if location is None:
+            return
 
-                self._update_summary()
-                self._dump_month()
-                break
+        with self._entities_lock:
+            self._refresh_entities()
+
+            with self._month_lock(*location):
+                data = self._read_month(*location)
+                i = self._find_task(*location, data, task_id)
+                if i is None:
+                    return
+                task = data['tasks'][i]
+
+            series = self._recurring_by_id.get(task_id.split('_')[0])
+            if series and task.recurring:
+                # Deleting an occurrence ends the series there
+                self._end_recurring_task(series, task.date)
+                with self._month_lock(*location):
+                    self._read_month(*location)
+                return
+
+            with self._open_month(*location) as data:
+                data['tasks'] = [t for t in data['tasks'] if t.id != task_id]
+                self._update_summary(*location, data, removed=[task])
+
+            with self._lock:
+                self._task_months.pop(task_id, None)
+
+            # Remember a deleted detached occurrence so patching does not bring it back
+            if series and task_id != series.id:
+                self._skip_recurring_task(series, task.date)
+
+    def apply_batch(self, operations):
+        """Apply many task creates, updates and deletes, reading and writing each month once.
+
+        Plain changes are grouped by month and applied with one summary update and one
+        write per month. Changes to a recurring series touch every month it recurs in,
+        so they go through the single-task methods, after the changes queued before them.
+
+        Args:
+            operations: ('create', task), ('update', task) or ('delete', task_id) pairs
+
+        Returns:
+            One {'id', 'status'} per operation, status 'ok', 'not_found' or 'error' (with a 'message')
+        """
+        results = [{'id': task if op == 'delete' else task.id, 'status': 'ok'} for op, task in operations]
+
+        with self._entities_lock:
+            self._refresh_entities()
+            pending = {}
+            queued = set()
+
+            for index, (op, task) in enumerate(operations):
+                task_id = results[index]['id']
+                if task_id in queued:
+                    # Decided on the task as it is after the queued change, not before
+                    self._apply_batch_months(pending, results)
+                    queued.clear()
+
+                if op == 'create':
+                    if task.recurring:
+                        self._apply_batch_months(pending, results)
+                        self.save_task(task)
+                    else:
+                        date = parse_date(task.date)
+                        pending.setdefault((date.year, date.month), []).append((index, op, task))
+                    continue
+
+                location = self._locate_task(task_id, task.date if op == 'update' else None)
+                current = None
+                if location is not None:
+                    with self._month_lock(*location):
+                        data = self._read_month(*location)
+                        i = self._find_task(*location, data, task_id)
+                        current = data['tasks'][i] if i is not None else None
+                if current is None:
+                    results[index]['status'] = 'not_found'
+                    continue
+
+                series = self._recurring_by_id.get(task_id.split('_')[0])
+                if series and current.recurring and (op == 'delete' or task.recurring):
+                    self._apply_batch_months(pending, results)
+                    if op == 'delete':
+                        self.delete_task(task_id)
+                    else:
+                        try:
+                            self.update_task(task)
+                        except ValueError as e:
+                            results[index].update(status='error', message=str(e))
+                else:
+                    pending.setdefault(location, []).append((index, op, task))
+                    queued.add(task_id)
+
+            self._apply_batch_months(pending, results)
+
+        return results
+
+    def _apply_batch_months(self, pending, results):
+        """Apply queued plain task changes, one month at a time. Caller must hold the entities lock."""
+        skips = {}
+        for (year, month), operations in sorted(pending.items()):
+            with self._open_month(year, month) as data:
+                tasks = list(data['tasks'])
+                positions = {task.id: i for i, task in enumerate(tasks)}
+                removed, added = [], []
+
+                for index, op, task in operations:
+                    if op == 'create':
+                        positions[task.id] = len(tasks)
+                        tasks.append(task)
+                        added.append(task)
+                        continue
+
+                    task_id = results[index]['id']
+                    i = positions.get(task_id)
+                    current = tasks[i] if i is not None else None
+                    if current is None:
+                        results[index]['status'] = 'not_found'
+                        continue
+
+                    removed.append(current)
+                    if op == 'update':
+                        updated = replace(current)
+                        updated.update(task)
+                        tasks[i] = updated
+                        added.append(updated)
+                    else:
+                        tasks[i] = None
+                        series = self._recurring_by_id.get(task_id.split('_')[0])
+                        if series and task_id != series.id:
+                            skips.setdefault(series.id, []).append(current.date)
+
+                data['tasks'] = [task for task in tasks if task is not None]
+                self._update_summary(year, month, data, removed=removed, added=added)
+
+            with self._lock:
+                for index, op, _ in operations:
+                    if op == 'delete':
+                        self._task_months.pop(results[index]['id'], None)
+        pending.clear()
+
+        # Deleted detached occurrences, one series change each
+        for series_id, dates in skips.items():
+            self._change_recurring_task(self._recurring_by_id[series_id], lambda changed: [changed.skip(d) for d in dates])
 
     # Recurring tasks
 
     def load_recurring_tasks(self):
         """Load all recurring tasks."""
-        if not os.path.exists(self.recurring_path):
-            self.recurring_tasks = []
+        with self._entities_lock:
+            self._refresh_entities()
+            return self.recurring_tasks
+
+    def _dump_recurring_tasks(self, items):
+        """Replace the recurring tasks and dump them to a file. Caller must hold the entities lock."""
+        self._dump_entities('recurring_tasks', self.recurring_path, items)
+        self._invalidate_unsaved_months()
+
+    def _recurring_instance(self, series, day):
+        """Create the occurrence of a recurring series on a given day."""
+        day_str = day.isoformat()
+        return Task(
+            id=f"{series.id}_{day_str}",
+            date=day_str,
+            recurring=series.recurring,
+            **series.fields_on(day_str)
+        )
+
+    def _apply_recurring_task(self, series, data, year, month):
+        """Apply a recurring series to a month."""
+        start, end = month_range(year, month)
+        instances = [self._recurring_instance(series, day) for day in series.occurrences(start, end)]
+        data['tasks'].extend(instances)
+        data['series'][series.id] = series.revision
+        self._count(recurring_occurrences=len(instances))
+
+    def _apply_recurring_tasks(self, data, year, month):
+        """Apply all recurring tasks to a month."""
+        start, end = (day.isoformat() for day in month_range(year, month))
+        for task in self.recurring_tasks:
+            # Series that cannot fall in the month are not recorded in it either
+            if task.active_between(start, end):
+                self._apply_recurring_task(task, data, year, month)
+
+    def expand_recurring_tasks(self, start, end):
+        """Expand all recurring tasks into their occurrences between two dates.
+
+        Occurrences are generated on demand from the series and are not written
+        anywhere; saved months keep their own, possibly edited, copies.
+
+        Args:
+            start: First date, YYYY-MM-DD
+            end: Last date (inclusive), YYYY-MM-DD
+        """
+        start, end = parse_date(start), parse_date(end)
+        with self._entities_lock:
+            self._refresh_entities()
+            recurring_tasks = self.recurring_tasks
+
+        expanded = [
+            self._recurring_instance(series, day)
+            for series in recurring_tasks if series.active_between(start.isoformat(), end.isoformat())
+            for day in series.occurrences(start, end)
+        ]
+        self._count(recurring_occurrences=len(expanded))
+        return sorted(expanded, key=lambda x: x.date)
+
+    def _change_recurring_task(self, series, change):
+        """Apply a change to a copy of a series and save it. Caller must hold the entities lock."""
+        changed = series.copy()
+        change(changed)
+        self._dump_recurring_tasks([changed if t is series else t for t in self.recurring_tasks])
+
+    def _edit_recurring_task(self, series, task):
+        """Edit a series from an occurrence on. Caller must hold the entities lock."""
+        from_date = max(series.date, task.date)
+        self._change_recurring_task(series, lambda changed: changed.edit(task, from_date))
+
+    def _end_recurring_task(self, series, from_date):
+        """End a series before an occurrence. Caller must hold the entities lock."""
+        self._change_recurring_task(series, lambda changed: changed.end(from_date))
+
+    def _skip_recurring_task(self, series, date_str):
+        """Leave out a single occurrence of a series. Caller must hold the entities lock."""
+        self._change_recurring_task(series, lambda changed: changed.skip(date_str))
+
+    def _sync_recurring_tasks(self, year, month, data):
+        """Patch a month with series changes made since it was written. Caller must hold the month lock."""
+        removed, added = [], []
+        start, end = (day.isoformat() for day in month_range(year, month))
+        for series in self.recurring_tasks:
+            # A month that never recorded a series holds none of its occurrences
+            if series.id not in data['series'] and not series.active_between(start, end):
+                continue
+            synced = data['series'].get(series.id, 0)
+            if synced != series.revision:
+                self._patch_recurring_task(series, synced, year, month, data, removed, added)
+                data['series'][series.id] = series.revision
+
+        if removed or added:
+            self._count(recurring_patches=1, recurring_occurrences=len(added))
+            data['tasks'] = sorted(data['tasks'], key=lambda x: x.date)
+            self._update_summary(year, month, data, removed, added)
+            # Months that only exist as expansions are rebuilt on demand instead
+            if self._month_signature(year, month) is not None:
+                if self.journal:
+                    # Written at the next compaction (the lock order rules out journaling here),
+                    # after which cold reads and other workers no longer redo the patch
+                    with self._lock:
+                        self._patched_months.add((year, month))
+                else:
+                    self._dump_month(year, month, data)
+
+    def _patch_recurring_task(self, series, synced, year, month, data, removed, added):
+        """Bring a series' occurrences in a month up to date, from the first date changed since a revision."""
+        since = series.changed_since(synced)
+        start, end = month_range(year, month)
+        if since is None or since > end.isoformat():
+            return
+
+        first = max(start, parse_date(since)).isoformat()
+        expected = {f"{series.id}_{day.isoformat()}": day for day in series.occurrences(parse_date(first), end)}
+
+        tasks = []
+        present = set()
+        for task in data['tasks']:
+            # Detached occurrences (no longer recurring) are exceptions and stay as they are
+            if task.recurring and task.date >= first and task.id.split('_')[0] == series.id:
+                alive = task.id in expected or (task.id == series.id and not series.deleted)
+                if not alive:
+                    removed.append(task)
+                    continue
+
+                fields = series.fields_on(task.date)
+                if any(getattr(task, name) != value for name, value in fields.items()):
+                    removed.append(task)
+                    task = replace(task, **fields)
+                    added.append(task)
+
+            present.add(task.id)
+            tasks.append(task)
+
+        for task_id, day in expected.items():
+            if task_id not in present:
+                task = self._recurring_instance(series, day)
+                tasks.append(task)
+                added.append(task)
+
+        data['tasks'] = tasks
+
+    def collect_recurring_garbage(self, ended_before, dry_run=False):
+        """Drop deleted recurring series, and those that ended before a date, from recurring.json.
+
+        The months an ended series fell in are written out first, occurrences included,
+        so they keep showing them as plain stored tasks. Months still recording a dropped
+        series are brought up to date and rewritten without it.
+
+        Args:
+            ended_before: Series whose last date is before this one (YYYY-MM-DD) are dropped
+            dry_run: Only report what would be dropped
+
+        Returns:
+            The series before and dropped, the months rewritten (and how many of those had
+            no file yet) and the size of recurring.json before and after, compact
+        """
+        with self._entities_lock:
+            self._refresh_entities()
+            dead = [series for series in self.recurring_tasks if series.finished_before(ended_before)]
+            dead_ids = {series.id for series in dead}
+            kept = [series for series in self.recurring_tasks if series.id not in dead_ids]
+            report = {
+                'series': len(self.recurring_tasks),
+                'deleted_series_dropped': sum(1 for series in dead if series.deleted),
+                'ended_series_dropped': sum(1 for series in dead if not series.deleted),
+                'months_rewritten': 0,
+                'months_materialized': 0,
+                'bytes_before': _json_size(self.recurring_tasks),
+                'bytes_after': _json_size(kept)
+            }
+            if dry_run or not dead:
+                return report
+
+            months = set(self.stored_months())
+            for series in dead:
+                if not series.deleted:
+                    months.update(months_between(parse_date(series.date), parse_date(series.until)))
+
+            for year, month in sorted(months):
+                with self._month_lock(year, month):
+                    # Records every series that falls in the month, so ended ones are found here too
+                    data = self._read_month(year, month)
+                    if not dead_ids & data['series'].keys():
+                        continue
+                    for series_id in dead_ids:
+                        data['series'].pop(series_id, None)
+                    if self._month_signature(year, month) is None:
+                        report['months_materialized'] += 1
+                    self._dump_month(year, month, data)
+                    report['months_rewritten'] += 1
+
+            self._dump_recurring_tasks(kept)
+            # The task each series started from is reported on its own, as it outlives an ended series
+            self._log_changes([{'kind': 'tasks', 'id': series.id, 'month': series.date[:7]} for series in dead])
+            if self.journal:
+                self.compact_journal()
+            return report
+
+    # Entity files (projects, clients, recurring tasks)
+
+    def _refresh_entities(self):
+        """Reload entity files that another process has changed since we last read them."""
+        with self._entities_lock:
+            if not self._started:
+                self._start()
+            self._catch_up_journal()
+            for attr, (path, cls) in self._entity_files.items():
+                self._refresh_entity(attr, path, cls)
+
+    def _refresh_entity(self, attr, path, cls):
+        """Reload one entity list attribute if its file changed. Caller must hold the entities lock."""
+        signature = _file_signature(path)
+        if attr in self._entity_signatures and self._entity_signatures[attr] == signature:
+            return
+
+        if signature is None:
+            items = []
         else:
-            with open(self.recurring_path) as f:
-                self.recurring_tasks = [Task(**task) for task in json.load(f)]
+            items = self._snapshot_entities(attr, signature)
+        if items is None:
+            with open(path, 'rb') as f:
+                content = f.read()
+            self._count(entity_reads=1, entity_read_bytes=len(content))
+            items = [cls(**item) for item in json.loads(content)]
+        for record in self._journal_entities.get(attr, ()):
+            items = _apply_entity_record(items, record)
+
+        self._set_entities(attr, items)
+        if attr in self._entity_signatures:
+            # Unsaved months depend on recurring tasks and project rates
+            self._invalidate_unsaved_months()
+            if attr == 'projects':
+                self._distrust_summaries()
+        self._entity_signatures[attr] = signature
+
+    def _set_entities(self, attr, items):
+        """Replace an entity list and rebuild its indexes. Caller must hold the entities lock."""
+        setattr(self, attr, items)
+
+        if attr == 'recurring_tasks':
+            self._recurring_by_id = {t.id: t for t in items}
+        elif attr == 'projects':
+            self._projects_by_id = {p.id: p for p in items}
+            client_projects = {}
+            for project in items:
+                client_projects.setdefault(project.client_id, []).append(project)
+            self._client_projects = client_projects
+        elif attr == 'clients':
+            self._clients_by_id = {c.id: c for c in items}
+
+    def _dump_entities(self, attr, path, items):
+        """Replace an entity list and dump it to a file, or journal the change. Caller must hold the entities lock."""
+        previous = {item.id: item for item in getattr(self, attr)}
+        kept = {id(item) for item in previous.values()}
+        current = {item.id for item in items}
+        put = [[i, item] for i, item in enumerate(items) if id(item) not in kept]
+        delete = [item_id for item_id in previous if item_id not in current]
+
+        self._set_entities(attr, items)
+        if not self.journal:
+            self._entity_signatures[attr] = self._write_json(path, items)
+        elif put or delete:
+            self._append_journal({'entity': attr, 'put': put, 'delete': delete})
+
+        changes = []
+        for _, item in put:
+            change = {'kind': attr, 'id': item.id}
+            if attr == 'recurring_tasks':
+                # First date whose occurrences the change affects
+                old = previous.get(item.id)
+                change['from'] = item.changed_since(old.revision) if old else item.date
+            changes.append(change)
+        self._log_changes(changes + [{'kind': attr, 'id': item_id} for item_id in delete])
+
+    # Change log
+
+    def _log_changes(self, changes):
+        """Number some changes and append them to the change log. Caller must hold the entities lock."""
+        if not changes:
+            return
+        self._catch_up_changes()
+
+        lines = []
+        for change in changes:
+            self._change_seq += 1
+            change = {'seq': self._change_seq, **change}
+            self._changes.append(change)
+            lines.append(json.dumps(change, separators=(',', ':')) + '\n')
+        content = ''.join(lines).encode()
+
+        with open(self.changes_path, 'ab') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        self._changes_offset += len(content)
+        self._changes_signature = _file_signature(self.changes_path)
+
+        if len(self._changes) > 2 * self.change_log_size:
+            # Forget the oldest changes; clients that far behind start over
+            self._changes = self._changes[-self.change_log_size:]
+            self._start_change_log(self._changes[0]['seq'] - 1, self._changes)
+
+    def _start_change_log(self, since, changes=()):
+        """Rewrite the change log to start after a sequence number. Caller must hold the entities lock."""
+        header = json.dumps({'since': since}) + '\n'
+        content = (header + ''.join(json.dumps(c, separators=(',', ':')) + '\n' for c in changes)).encode()
+        self._changes_signature = self._replace_file(self.changes_path, content)
+        self._changes_since = since
+        self._changes_offset = len(content)
+
+    def _catch_up_changes(self):
+        """Read changes other processes appended to the change log. Caller must hold the entities lock."""
+        signature = _file_signature(self.changes_path)
+        if signature is not None and signature == self._changes_signature:
+            return
 
-        return self.recurring_tasks
+        if signature is None:
+            self._changes = []
+            self._start_change_log(self._change_seq)
+            return
 
-    def _should_add_recurring_task(self, task, date):
-        """Check if a recurring task should be added on a specific date."""
-        task_date = datetime.strptime(task.date, "%Y-%m-%d")
-        if task.recurring == 'daily':
-            return True
-        elif task.recurring == 'weekly':
-            return date.weekday() == task_date.weekday()
-        elif task.recurring == 'monthly':
-            return date.day == task_date.day
-        return False
-
-    def _apply_recurring_task(self, task):
-        """Apply a recurring task to current month."""
-        if task.deleted:
+        with open(self.changes_path, 'rb') as f:
+            header = f.readline()
+            since = json.loads(header)['since']
+            if since != self._changes_since:
+                # Trimmed elsewhere, or read for the first time
+                self._changes = []
+                self._changes_since = since
+                self._changes_offset = len(header)
+            f.seek(self._changes_offset)
+            chunk = f.read()
+
+        end = chunk.rfind(b'\n') + 1
+        self._changes.extend(json.loads(line) for line in chunk[:end].splitlines())
+        self._changes_offset += end
+        self._changes_signature = signature if end == len(chunk) else None
+        self._change_seq = self._changes[-1]['seq'] if self._changes else since
+
+    def change_seq(self):
+        """Get the sequence number of the latest change."""
+        with self._entities_lock:
+            self._catch_up_changes()
+            return self._change_seq
+
+    def changes_since(self, seq):
+        """Get the tasks, projects, clients and recurring tasks changed after a sequence number.
+
+        Each kind lists the current version of everything changed and the ids of
+        what was deleted. Occurrences regenerated from an edited recurring task are
+        not listed one by one; recurring_changed_from gives the first date affected.
+        With reset set the changes are no longer known and the client must reload.
+        """
+        with self._entities_lock:
+            self._refresh_entities()
+            self._catch_up_changes()
+
+            result = {'seq': self._change_seq, 'reset': seq < self._changes_since or seq > self._change_seq}
+            if result['reset']:
+                return result
+
+            latest = {}
+            start = bisect_right([c['seq'] for c in self._changes], seq)
+            for change in self._changes[start:]:
+                latest[change['kind'], change['id']] = change
+
+            by_id = {
+                'projects': self._projects_by_id,
+                'clients': self._clients_by_id,
+                'recurring_tasks': self._recurring_by_id
+            }
+            for kind in ('tasks', *by_id):
+                result[kind] = {'updated': [], 'deleted': []}
+
+            months = {}
+            changed_from = None
+            for (kind, item_id), change in latest.items():
+                if kind == 'tasks':
+                    months.setdefault(change['month'], []).append(item_id)
+                    continue
+                item = by_id[kind].get(item_id)
+                if item is None:
+                    result[kind]['deleted'].append(item_id)
+                else:
+                    result[kind]['updated'].append(item)
+                if change.get('from') and (changed_from is None or change['from'] < changed_from):
+                    changed_from = change['from']
+            result['recurring_changed_from'] = changed_from
+
+            for month_str, task_ids in sorted(months.items()):
+                year, month = map(int, month_str.split('-'))
+                with self._month_lock(year, month):
+                    tasks = {task.id: task for task in self._read_month(year, month)['tasks']}
+                for task_id in task_ids:
+                    if task_id in tasks:
+                        result['tasks']['updated'].append(tasks[task_id])
+                    else:
+                        result['tasks']['deleted'].append(task_id)
+            return result
+
+    # Journal
+
+    def _append_journal(self, record):
+        """Append a change to the journal. Caller must hold the entities lock."""
+        self._journal_seq += 1
+        record = {'seq': self._journal_seq, **record}
+        line = (json.dumps(record, separators=(',', ':'), default=lambda x: x.to_dict()) + '\n').encode()
+
+        with open(self.journal_path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._count(journal_appends=1, journal_bytes=len(line))
+
+        self._journal_offset += len(line)
+        self._journal_signature = _file_signature(self.journal_path)
+        self._add_journal_record(record)
+        if self._journal_records >= self.journal_max_records:
+            self._compaction_wanted.set()
+
+    def _add_journal_record(self, record):
+        """Remember a journal record until the next compaction. Caller must hold the entities lock."""
+        with self._lock:
+            if 'month' in record:
+                key = tuple(record['month'])
+                self._journal_months.setdefault(key, []).append(record)
+            else:
+                key = record['entity']
+                self._journal_entities.setdefault(key, []).append(record)
+            self._journal_versions[key] = record['seq']
+            self._journal_records += 1
+
+    def _catch_up_journal(self):
+        """Apply journal records appended by other processes. Caller must hold the entities lock."""
+        signature = _file_signature(self.journal_path)
+        if signature == self._journal_signature:
             return
 
-        task_date = datetime.strptime(task.date, '%Y-%m-%d')
-        start_of_month = self.date
-        end_of_month = (start_of_month.replace(month=start_of_month.month % 12 + 1, day=1) - timedelta(days=1))
-        end_of_month = end_of_month.replace(year=start_of_month.year)
-
-        current_date = start_of_month
-
-        while current_date <= end_of_month:
-            if current_date >= task_date and self._should_add_recurring_task(task, current_date):
-                new_task = Task(
-                    id=f"{task.id}_{current_date.strftime('%Y-%m-%d')}",
-                    project_id=task.project_id,
-                    client_id=task.client_id,
-                    date=current_date.strftime("%Y-%m-%d"),
-                    hours=task.hours,
-                    title=task.title,
-                    notes=task.notes,
-                    recurring=task.recurring
-                )
-                self.data['tasks'].append(new_task)
-
-            current_date += timedelta(days=1)
-
-    def _apply_recurring_tasks(self):
-        """Apply all recurring tasks to current month."""
-        for task in self.recurring_tasks:
-            self._apply_recurring_task(task)
-
-    def _update_recurring_task(self, task):
-        """Update a recurring task in the storage. Update all future tasks too."""
-        recurring_task = [t for t in self.recurring_tasks if task.id.startswith(t.id)][0]
-        recurring_task_date = datetime.strptime(recurring_task.date, '%Y-%m-%d')
-        task_date = datetime.strptime(task.date, '%Y-%m-%d')
-        recurring_task_date = recurring_task_date if recurring_task_date > task_date else task_date
-
-        if task.recurring:
-            recurring_task.update(task)
-
-            for future_task in self.data['tasks']:
-                if future_task.id.startswith(recurring_task.id) and datetime.strptime(future_task.date, '%Y-%m-%d') >= recurring_task_date and future_task.recurring:
-                    future_task.update(task)
-
-            with open(self.recurring_path, 'w') as f:
-                json.dump(self.recurring_tasks, f, indent=2, default=lambda x: x.__dict__)
-
-            self._update_summary()
-            self._dump_month()
-
-            # update upcoming months
-            for month in os.listdir(os.path.join(self.path, 'months')):
-                year, month = map(int, month.replace('.json', '').split('_'))
-                if datetime(year, month, 1) > recurring_task_date:
-                    self.load_month(year, month)
-                    for future_task in self.data['tasks']:
-                        if future_task.id.startswith(recurring_task.id) and future_task.recurring:
-                            future_task.update(task)
-                    self._update_summary()
-                    self._dump_month()
-
-            # Load the current month again
-            self.load_month(recurring_task_date.year, recurring_task_date.month)
-
-    def _delete_recurring_task(self, task):
-        """Delete a recurring task from the storage."""
-        recurring_task = [t for t in self.recurring_tasks if task.id.startswith(t.id)][0]
-        recurring_task.delete()
-        remove_date = datetime.strptime(task.date, '%Y-%m-%d')
-
-        for future_task in reversed(self.data['tasks']):
-            if future_task.id.startswith(recurring_task.id) and datetime.strptime(future_task.date, '%Y-%m-%d') >= remove_date and future_task.recurring:
-                self.data['tasks'].remove(future_task)
-
-        with open(self.recurring_path, 'w') as f:
-            json.dump(self.recurring_tasks, f, indent=2, default=lambda x: x.__dict__)
-
-        self._update_summary()
-        self._dump_month()
-
-        # update upcoming months
-        for month in os.listdir(os.path.join(self.path, 'months')):
-            year, month = map(int, month.replace('.json', '').split('_'))
-            if datetime(year, month, 1) > remove_date:
-                self.load_month(year, month)
-                for future_task in self.data['tasks']:
-                    if future_task.id.startswith(recurring_task.id):
-                        self.data['tasks'].remove(future_task)
-                self._update_summary()
-                self._dump_month()
-
-        # Load the current month again
-        self.load_month(remove_date.year, remove_date.month)
+        if signature is None:
+            # Folded into the files by a process running without the journal
+            self._reset_journal({})
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            header = f.readline()
+            if json.loads(header).get('generation') != self._journal_generation:
+                # Compacted elsewhere: everything we cached may predate the new files
+                self._reset_journal(json.loads(header))
+                self._journal_offset = len(header)
+            f.seek(self._journal_offset)
+            chunk = f.read()
+
+        # A line still being written is picked up next time
+        end = chunk.rfind(b'\n') + 1
+        for line in chunk[:end].splitlines():
+            self._replay_journal_record(self._decode_journal_record(json.loads(line)))
+        self._journal_offset += end
+        self._journal_signature = signature if end == len(chunk) else None
+
+    def _decode_journal_record(self, record):
+        """Turn the entities of a parsed journal record back into objects."""
+        if 'month' in record:
+            record['put'] = [Task(**task) for task in record['put']]
+        else:
+            cls = self._entity_files[record['entity']][1]
+            record['put'] = [[i, cls(**item)] for i, item in record['put']]
+        return record
+
+    def _replay_journal_record(self, record):
+        """Apply a journal record written by another process. Caller must hold the entities lock."""
+        self._journal_seq = record['seq']
+        self._add_journal_record(record)
+
+        if 'month' in record:
+            year, month = record['month']
+            with self._month_lock(year, month):
+                with self._lock:
+                    cached = self._month_cache.get((year, month))
+                # Months not in the cache get the record when they are read
+                if cached:
+                    try:
+                        removed, added = self._apply_month_record(year, month, cached[1], record)
+                        self._update_summary(year, month, cached[1], removed, added)
+                    except Exception:
+                        # Read again, with the record, by whoever needs the month next
+                        logger.exception("Could not apply a journal record to %d-%02d", year, month)
+                        with self._lock:
+                            self._month_cache.pop((year, month), None)
+                            self._trusted_summaries.discard((year, month))
+            return
+
+        attr = record['entity']
+        if attr in self._entity_signatures:
+            self._set_entities(attr, _apply_entity_record(getattr(self, attr), record))
+            # Unsaved months depend on recurring tasks and project rates
+            self._invalidate_unsaved_months()
+            if attr == 'projects':
+                self._distrust_summaries()
+
+    def _reset_journal(self, header):
+        """Forget journal state and cached data after the journal was compacted by someone else."""
+        with self._lock:
+            self._month_cache.clear()
+            self._month_indexes.clear()
+            self._trusted_summaries.clear()
+            self._journal_months = {}
+            self._journal_entities = {}
+            self._journal_versions = {}
+            self._journal_records = 0
+        self._entity_signatures.clear()
+        self._journal_generation = header.get('generation')
+        self._journal_seq = max(self._journal_seq, header.get('seq', 0))
+        self._journal_offset = 0
+        self._journal_signature = None
+
+    def _start_journal(self):
+        """Replace the journal with an empty one of a new generation. Caller must hold the entities lock."""
+        self._journal_generation = uuid.uuid4().hex
+        header = (json.dumps({'generation': self._journal_generation, 'seq': self._journal_seq}) + '\n').encode()
+        self._journal_signature = self._replace_file(self.journal_path, header)
+        self._journal_offset = len(header)
+
+    def compact_journal(self):
+        """Fold the journal into the month and entity files and start a new one.
+
+        Replaying over files that already contain some of the changes is harmless,
+        so a crash halfway through only means the next run does it again.
+        """
+        with self._entities_lock:
+            self._refresh_entities()
+
+            with self._lock:
+                patched = self._patched_months - self._journal_months.keys()
+                self._patched_months = set()
+            for year, month in sorted(patched):
+                try:
+                    with self._month_lock(year, month):
+                        self._dump_month(year, month, self._read_month(year, month))
+                except Exception:
+                    # Patched again when next read
+                    logger.exception("Could not write out %d-%02d after a recurring task change", year, month)
+
+            compacted = self._journal_records > 0
+            if compacted:
+                failed = []
+                for year, month in sorted(self._journal_months):
+                    try:
+                        with self._month_lock(year, month):
+                            self._dump_month(year, month, self._read_month(year, month))
+                    except Exception:
+                        logger.exception("Could not fold the journal into %d-%02d", year, month)
+                        failed.append((year, month))
+                for attr in self._journal_entities:
+                    path = self._entity_files[attr][0]
+                    self._entity_signatures[attr] = self._write_json(path, getattr(self, attr))
+                if failed:
+                    # Keep the journal, so those months still get its changes; the rest replay harmlessly
+                    return
+
+                with self._lock:
+                    self._journal_months = {}
+                    self._journal_entities = {}
+                    self._journal_versions = {}
+                    self._journal_records = 0
+
+            if self.journal:
+                if compacted or self._journal_generation is None:
+                    self._start_journal()
+            elif os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+                self._reset_journal({})
+
+            # Only entity lists without unsaved journal records match their files
+            if self.entity_snapshot and not self._journal_entities:
+                self._save_snapshot()
+
+    # Entity snapshot
+
+    def _snapshot_fields(self):
+        """Field names of every entity class, so a snapshot taken before a model change is not used."""
+        return {attr: [field.name for field in fields(cls)] for attr, (_, cls) in self._entity_files.items()}
+
+    def _load_snapshot(self):
+        """Read the entity snapshot, if there is a usable one. Caller must hold the entities lock."""
+        self._snapshot = {}
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception:
+            logger.warning("Ignoring unreadable entity snapshot %s", self.snapshot_path)
+            return
+
+        if snapshot.get('format') == SNAPSHOT_FORMAT and snapshot.get('fields') == self._snapshot_fields():
+            self._snapshot = snapshot['entities']
+            self._snapshot_signatures = {attr: signature for attr, (signature, _) in self._snapshot.items()}
+
+    def _snapshot_entities(self, attr, signature):
+        """Take an entity list from the snapshot if it matches the file. Caller must hold the entities lock."""
+        if not self.entity_snapshot:
+            return None
+        if self._snapshot is None:
+            self._load_snapshot()
+
+        # Only used for the first load; later changes come from the files and the journal
+        entry = self._snapshot.pop(attr, None)
+        if entry is None or entry[0] != signature:
+            return None
+        self._count(snapshot_reads=1)
+        return entry[1]
+
+    def _save_snapshot(self):
+        """Snapshot the entity lists, which must match their files. Caller must hold the entities lock."""
+        signatures = {attr: self._entity_signatures[attr] for attr in self._entity_files
+                      if self._entity_signatures.get(attr) is not None}
+        if signatures == self._snapshot_signatures:
+            return
+
+        snapshot = {
+            'format': SNAPSHOT_FORMAT,
+            'fields': self._snapshot_fields(),
+            'entities': {attr: (signature, getattr(self, attr)) for attr, signature in signatures.items()}
+        }
+        self._replace_file(self.snapshot_path, pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+        self._snapshot_signatures = signatures
+
+    def _compact_periodically(self):
+        """Compact the journal every so often, or sooner once it grows long."""
+        while True:
+            self._compaction_wanted.wait(self.journal_compact_interval)
+            self._compaction_wanted.clear()
+            if self._closed:
+                return
+            try:
+                self.compact_journal()
+            except Exception:
+                logger.exception("Journal compaction failed")
 
     # Projects
 
     def load_projects(self):
         """Load all projects."""
-        if not os.path.exists(self.project_path):
-            self.projects = []
-        else:
-            with open(self.project_path) as f:
-                self.projects = [Project(**project) for project in json.load(f)]
-
-        return self.projects
+        with self._entities_lock:
+            self._refresh_entities()
+            return self.projects
 
     def _get_project(self, project_id):
         """Get a specific project by ID."""
-        for project in self.projects:
-            if project.id == project_id:
-                return project
-        return None
+        return self._projects_by_id.get(project_id)
 
     def save_project(self, project):
         """Save a new project to the storage."""
-        self.projects.append(project)
-
-        # Sort the projects by name
-        self.projects = sorted(self.projects, key=lambda x: x.name)
+        with self._entities_lock:
+            self._refresh_entities()
 
-        with open(self.project_path, 'w') as f:
-            json.dump(self.projects, f, indent=2, default=lambda x: x.__dict__)
+            # Sort the projects by name
+            self._dump_entities('projects', self.project_path, sorted(self.projects + [project], key=lambda x: x.name))
 
     def update_project(self, project):
         """Update an existing project in the storage."""
-        for p in self.projects:
-            if p.id == project.id:
-                p.update(project)
-                break
+        with self._entities_lock:
+            self._refresh_entities()
+
+            old = self._projects_by_id.get(project.id)
+            if old is None:
+                return
 
-        with open(self.project_path, 'w') as f:
-            json.dump(self.projects, f, indent=2, default=lambda x: x.__dict__)
+            updated = replace(old)
+            updated.update(project)
+            self._dump_entities('projects', self.project_path, [updated if p is old else p for p in self.projects])
+
+            # Summaries were priced with the old rates
+            self._invalidate_unsaved_months()
+            self._distrust_summaries()
 
     def delete_project(self, project_id):
         """Delete a project from the storage."""
-        self.projects = [p for p in self.projects if p.id != project_id]
+        with self._entities_lock:
+            self._refresh_entities()
 
-        with open(self.project_path, 'w') as f:
-            json.dump(self.projects, f, indent=2, default=lambda x: x.__dict__)
+            self._dump_entities('projects', self.project_path, [p for p in self.projects if p.id != project_id])
 
     # Clients
 
     def load_clients(self):
         """Load all clients."""
-        if not os.path.exists(self.clients_path):
-            self.clients = []
-        else:
-            with open(self.clients_path) as f:
-                self.clients = [Client(**client) for client in json.load(f)]
-
-        return self.clients
+        with self._entities_lock:
+            self._refresh_entities()
+            return self.clients
 
     def get_client_projects(self, client_id):
         """Get all projects for a specific client."""
-        return [p for p in self.projects if p.client_id == client_id]
+        with self._entities_lock:
+            self._refresh_entities()
+            return list(self._client_projects.get(client_id, []))
 
     def save_client(self, client):
         """Save a new client to the storage."""
-        self.clients.append(client)
-
-        # Sort the clients by name
-        self.clients = sorted(self.clients, key=lambda x: x.name)
+        with self._entities_lock:
+            self._refresh_entities()
 
-        with open(self.clients_path, 'w') as f:
-            json.dump(self.clients, f, indent=2, default=lambda x: x.__dict__)
+            # Sort the clients by name
+            self._dump_entities('clients', self.clients_path, sorted(self.clients + [client], key=lambda x: x.name))
 
     def update_client(self, client):
         """Update an existing client in the storage."""
-        for c in self.clients:
-            if c.id == client.id:
-                c.update(client)
-                break
+        with self._entities_lock:
+            self._refresh_entities()
+
+            old = self._clients_by_id.get(client.id)
+            if old is None:
+                return
 
-        with open(self.clients_path, 'w') as f:
-            json.dump(self.clients, f, indent=2, default=lambda x: x.__dict__)
+            updated = replace(old)
+            updated.update(client)
+            self._dump_entities('clients', self.clients_path, [updated if c is old else c for c in self.clients])
 
     def save_client_logo(self, client_id, file):
-        """Save a client logo file and return the path."""
+        """Save a client logo file under a name derived from its content and return the path."""
         if not file:
             return None
 
-        filename = secure_filename(f"{client_id}_{file.filename}")
+        content = file.read()
+        filename = logo_filename(client_id, content, file.filename)
         file_path = os.path.join(self.logos_path, filename)
 
-        # Remove old logo if it exists
-        old_logo = self._get_client_logo(client_id)
-        if old_logo and os.path.exists(old_logo):
-            os.remove(old_logo)
-            
-        file.save(file_path)
+        with self._entities_lock:
+            # Remove old logo if it exists
+            old_logo = self._get_client_logo(client_id)
+            if old_logo and os.path.exists(old_logo):
+                os.remove(old_logo)
+            self._client_logos.pop(client_id, None)
+
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            self._client_logos[client_id] = filename
         return f"/api/logos/{filename}"
 
     def _get_client_logo(self, client_id):
-        """Get the logo path for a client."""
-        if not os.path.exists(self.logos_path):
+        """Get the logo path for a client. Caller must hold the entities lock."""
+        try:
+            signature = os.stat(self.logos_path).st_mtime_ns
+        except FileNotFoundError:
             return None
 
-        for filename in os.listdir(self.logos_path):
-            if filename.startswith(f"{client_id}_"):
-                return os.path.join(self.logos_path, filename)
-        return None
+        # Adding or removing a logo changes the directory mtime
+        if signature != self._logos_signature:
+            self._client_logos = {filename.split('_', 1)[0]: filename for filename in os.listdir(self.logos_path)}
+            self._logos_signature = signature
+
+        filename = self._client_logos.get(client_id)
+        return os.path.join(self.logos_path, filename) if filename else None
 
     def delete_client(self, client_id):
         """Delete a client and their logo from storage."""
-        # Delete logo if it exists
-        logo_path = self._get_client_logo(client_id)
-        if logo_path and os.path.exists(logo_path):
-            os.remove(logo_path)
-
-        # Existing client deletion code
-        self.clients = [c for c in self.clients if c.id != client_id]
-        with open(self.clients_path, 'w') as f:
-            json.dump(self.clients, f, indent=2, default=lambda x: x.__dict__)
+        with self._entities_lock:
+            self._refresh_entities()
+
+            # Delete logo if it exists
+            logo_path = self._get_client_logo(client_id)
+            if logo_path and os.path.exists(logo_path):
+                os.remove(logo_path)
+            self._client_logos.pop(client_id, None)
+
+            # Existing client deletion code
+            self._dump_entities('clients', self.clients_path, [c for c in self.clients if c.id != client_id])
+
+
+def _file_signature(path):
+    """Get the (mtime, size) of a file, None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _fsync_directory(path):
+    """Persist a rename in a directory, where the platform supports it."""
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _json_size(items):
+    """Size of a list of entities written as compact JSON."""
+    return len(json.dumps(items, separators=(',', ':'), default=lambda x: x.to_dict()).encode())
+
+
+def _version_tag(*state):
+    """Condense some state into a short tag."""
+    return hashlib.sha1(repr(state).encode()).hexdigest()[:20]
+
+
+def _apply_entity_record(items, record):
+    """Apply a journaled entity change to an entity list and return the new list."""
+    replaced = set(record['delete']) | {item.id for _, item in record['put']}
+    items = [item for item in items if item.id not in replaced]
+    for i, item in record['put']:
+        items.insert(i, item)
+    return items
+
+
+def _copy_summary(summary):
+    """Copy a month summary down to its per-project totals."""
+    return {
+        client_id: {**client, 'projects': {project_id: dict(totals) for project_id, totals in client['projects'].items()}}
+        for client_id, client in summary.items()
+    }
+
+
+def _summaries_match(a, b, tolerance=1e-6):
+    """Compare two month summaries, allowing for floating point drift."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_summaries_match(a[k], b[k], tolerance) for k in a)
+    return abs(a - b) <= tolerance
@@ -1,5 +1,6 @@
 import React from 'react';
 import { filterProjects, groupProjectsByClient, calculateProjectMetrics } from '../utils/summaries';
+import { apiUrl } from '../services/api';
 
 // Reusable components
 const ClientLogo = ({ client }) => {
@@ -8,7 +9,7 @@ const ClientLogo = ({ client }) => {
     return (
         <div className="flex flex-col items-center space-y-4 mb-8">
             <img
-                src={client.logo_path}
+                src={`${apiUrl(client.logo_path)}?size=medium`}
                 alt={`${client.name} logo`}
                 className="object-contain"
             />
@@ -1,6 +1,7 @@
 import React from 'react';
 import { Trash2 } from 'lucide-react';
 import { Input, Button, Label } from './StyledComponents';
+import { apiUrl } from '../../services/api';
 
 export const ClientDetailForm = ({
     formData,
@@ -51,7 +52,7 @@ export const ClientDetailForm = ({
             {formData.logo_path && (
                 <div className="mt-2 flex items-center gap-2">
                     <img
-                        src={formData.logo_path}
+                        src={apiUrl(formData.logo_path)}
                         alt="Logo preview"
                         className="h-16 object-contain"
                     />
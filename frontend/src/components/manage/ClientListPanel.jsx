@@ -1,6 +1,7 @@
 import React from 'react';
 import { Plus } from 'lucide-react';
 import { ListItem } from './StyledComponents';
+import { apiUrl } from '../../services/api';
 
 export const ClientListPanel = ({
     clients,
@@ -33,7 +34,7 @@ export const ClientListPanel = ({
                     <div className="flex items-center space-x-3 min-w-0">
                         {client.logo_path ? (
                             <img
-                                src={client.logo_path}
+                                src={`${apiUrl(client.logo_path)}?size=small`}
                                 alt=""
                                 className="w-6 h-6 object-contain flex-shrink-0"
                             />
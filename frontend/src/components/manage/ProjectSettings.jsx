@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import { INITIAL_PROJECT_FORM, INITIAL_CLIENT_FORM } from './constants';
+import { apiUrl } from '../../services/api';
 import { TabSwitcher } from './TabSwitcher';
 import { EmptyDetailState } from './EmptyDetailState';
 import { MasterDetailLayout } from './MasterDetailLayout';
@@ -58,7 +59,7 @@ export const ProjectSettings = ({
 
     const handleToggleVisibility = async (project) => {
         const updatedProject = { ...project, hidden: !project.hidden };
-        await fetch(`/api/projects/${project.id}`, {
+        await fetch(apiUrl(`/api/projects/${project.id}`), {
             method: 'PUT',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(updatedProject)
@@ -69,8 +70,8 @@ export const ProjectSettings = ({
     const handleProjectSubmit = async (e) => {
         e.preventDefault();
         const endpoint = projectMode === 'edit'
-            ? `/api/projects/${selectedProject}`
-            : '/api/projects';
+            ? apiUrl(`/api/projects/${selectedProject}`)
+            : apiUrl('/api/projects');
         const method = projectMode === 'edit' ? 'PUT' : 'POST';
 
         await fetch(endpoint, {
@@ -1,7 +1,13 @@
+// Opened under /p/<name>/, the app works on that profile, so its API requests carry the same prefix
+const PROFILE_PREFIX = (window.location.pathname.match(/^\/p\/[A-Za-z0-9_-]+/) || [''])[0];
+
+// API paths, logo paths included, within the current profile; anything else (like blob: previews) as is
+export const apiUrl = (path) => (path && path.startsWith('/api/') ? PROFILE_PREFIX + path : path);
+
 const API_ENDPOINTS = {
-    TASKS: '/api/tasks',
-    CLIENTS: '/api/clients',
-    PROJECTS: '/api/projects'
+    TASKS: apiUrl('/api/tasks'),
+    CLIENTS: apiUrl('/api/clients'),
+    PROJECTS: apiUrl('/api/projects')
 };
 
 export const apiService = {
@@ -25,7 +25,7 @@ fi
 
 # Install backend dependencies
 echo "Installing backend dependencies..."
-"$SCRIPT_DIR/backend/venv/bin/pip" install -q flask flask-cors werkzeug
+"$SCRIPT_DIR/backend/venv/bin/pip" install -q flask flask-cors werkzeug gunicorn pillow
 
 # Install frontend dependencies
 echo "Installing frontend dependencies..."
@@ -48,6 +48,7 @@ After=network.target
 Type=simple
 WorkingDirectory=$SCRIPT_DIR
 ExecStart=/bin/bash $SCRIPT_DIR/run.sh
+ExecReload=/bin/kill -HUP \$MAINPID
 Restart=on-failure
 RestartSec=10
 StandardOutput=journal
@@ -7,4 +7,9 @@ cd "$SCRIPT_DIR"
 # Start Flask (serves both API and frontend)
 cd backend
 source venv/bin/activate
-exec python app.py
+
+# Production server by default; TASKLORD_SERVER=dev runs the Flask development server
+if [ "$TASKLORD_SERVER" = "dev" ] || ! command -v gunicorn &> /dev/null; then
+    exec python app.py
+fi
+exec gunicorn -c gunicorn.conf.py wsgi:app